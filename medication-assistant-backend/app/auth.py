@@ -48,36 +48,55 @@
 #         raise credentials_exception
 #     return user
 
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 from .config import settings
-from .database import get_db
+from .database import DbSession, get_db, run_db
 from . import models
 
-# Use bcrypt_sha256 to safely support long/Unicode passwords.
-# Also include "bcrypt" to verify any legacy hashes (if some users were already created).
-pwd_context = CryptContext(
-    schemes=["bcrypt_sha256", "bcrypt"],
-    deprecated="auto"
-)
+_pwd_context = None
+
+
+def get_pwd_context():
+    # Built on first use so importing the app doesn't load passlib and its bcrypt backend
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        # Use bcrypt_sha256 to safely support long/Unicode passwords.
+        # Also include "bcrypt" to verify any legacy hashes (if some users were already created).
+        _pwd_context = CryptContext(
+            schemes=["bcrypt_sha256", "bcrypt"],
+            deprecated="auto"
+        )
+    return _pwd_context
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     # New hashes will use the first (preferred) scheme in the context i.e., bcrypt_sha256
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    # True for legacy plain "bcrypt" hashes (deprecated="auto")
+    return get_pwd_context().needs_update(hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -88,7 +107,94 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user as seen by route handlers; detached from any session."""
+    id: int
+    email: str
+    full_name: Optional[str]
+    is_active: bool
+    timezone: str = 'UTC'
+
+
+# token digest -> (expires_at monotonic, Principal); user id -> token digests for invalidation.
+# Per process: other workers converge within AUTH_CACHE_TTL_SECONDS.
+_principals: "OrderedDict[str, tuple[float, Principal]]" = OrderedDict()
+_tokens_by_user: dict[int, set[str]] = {}
+_principals_lock = threading.Lock()
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _drop(digest: str) -> None:
+    _, principal = _principals.pop(digest)
+    digests = _tokens_by_user.get(principal.id)
+    if digests is not None:
+        digests.discard(digest)
+        if not digests:
+            del _tokens_by_user[principal.id]
+
+
+def _cached_principal(digest: str) -> Optional[Principal]:
+    with _principals_lock:
+        entry = _principals.get(digest)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            _drop(digest)
+            return None
+        _principals.move_to_end(digest)
+        return entry[1]
+
+
+def _cache_principal(digest: str, principal: Principal, token_exp: Optional[int]) -> None:
+    ttl = settings.auth_cache_ttl_seconds
+    if token_exp is not None:
+        ttl = min(ttl, token_exp - time.time())
+    if ttl <= 0:
+        return
+    with _principals_lock:
+        if digest in _principals:
+            _drop(digest)
+        _principals[digest] = (time.monotonic() + ttl, principal)
+        _tokens_by_user.setdefault(principal.id, set()).add(digest)
+        while len(_principals) > settings.auth_cache_max_entries:
+            _drop(next(iter(_principals)))
+
+
+def invalidate_user(user_id: int) -> None:
+    """Forget every cached principal for user_id (call on deactivation/deletion)."""
+    with _principals_lock:
+        for digest in list(_tokens_by_user.get(user_id, ())):
+            _drop(digest)
+
+
+@event.listens_for(models.User, 'after_update')
+@event.listens_for(models.User, 'after_delete')
+def _invalidate_on_change(mapper, connection, target: models.User) -> None:
+    # ORM-level only: bulk query.update()/delete() on users must call invalidate_user explicitly
+    invalidate_user(target.id)
+
+
+def _load_user(db: Session, user_id: int) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+
+def _ensure_active(principal: Principal) -> Principal:
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    return principal
+
+
+async def get_current_user(db: DbSession = Depends(get_db), token: str = Depends(oauth2_scheme)) -> Principal:
+    # Cache hit: no JWT decode and no users query (the session never opens a connection)
+    digest = _token_digest(token)
+    principal = _cached_principal(digest)
+    if principal is not None:
+        return _ensure_active(principal)
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -102,7 +208,10 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+    user = await run_db(db, _load_user, int(user_id))
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    principal = Principal(id=user.id, email=user.email, full_name=user.full_name, is_active=bool(user.is_active),
+                          timezone=user.timezone)
+    _cache_principal(digest, principal, payload.get("exp"))
+    return _ensure_active(principal)
\ No newline at end of file
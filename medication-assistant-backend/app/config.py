@@ -29,12 +29,121 @@ class Settings(BaseSettings):
     jwt_secret: str = Field(alias='JWT_SECRET', default='changeme')
     jwt_algorithm: str = Field(alias='JWT_ALGORITHM', default='HS256')
     access_token_expire_minutes: int = Field(alias='ACCESS_TOKEN_EXPIRE_MINUTES', default=60)
+    # Verified-principal cache for get_current_user (entries never outlive the token's exp)
+    auth_cache_ttl_seconds: int = Field(alias='AUTH_CACHE_TTL_SECONDS', default=300)
+    auth_cache_max_entries: int = Field(alias='AUTH_CACHE_MAX_ENTRIES', default=10000)
+    # bcrypt process pool: 0 workers = one per available core; beyond max pending, 503 + Retry-After
+    password_hash_workers: int = Field(alias='PASSWORD_HASH_WORKERS', default=0)
+    password_hash_max_pending: int = Field(alias='PASSWORD_HASH_MAX_PENDING', default=32)
+    password_hash_retry_after: int = Field(alias='PASSWORD_HASH_RETRY_AFTER', default=2)
+
+    # Database engine: DB_ASYNC switches the routes to an AsyncEngine; scheduler jobs keep
+    # the sync engine in their own threads so a tick never blocks the event loop.
+    # DATABASE_ASYNC_URL defaults to DATABASE_URL with the asyncpg/aiosqlite driver.
+    db_async: bool = Field(alias='DB_ASYNC', default=False)
+    database_async_url: str = Field(alias='DATABASE_ASYNC_URL', default='')
+    db_pool_size: int = Field(alias='DB_POOL_SIZE', default=5)
+    db_max_overflow: int = Field(alias='DB_MAX_OVERFLOW', default=10)
+    db_pool_timeout: float = Field(alias='DB_POOL_TIMEOUT', default=30.0)
+    db_pool_recycle: int = Field(alias='DB_POOL_RECYCLE', default=1800)
+    # Create missing tables/columns at startup (dev). Otherwise run `python -m app.migrations` once per deploy.
+    db_create_all: bool = Field(alias='DB_CREATE_ALL', default=False)
+
+    # GET /adherence/analytics results cached per user until their doses or medications change
+    analytics_cache_max_entries: int = Field(alias='ANALYTICS_CACHE_MAX_ENTRIES', default=1000)
+
+    # Largest request body POST /bulk/medications accepts (413 beyond); bodies over 1 MB spool to disk
+    bulk_import_max_bytes: int = Field(alias='BULK_IMPORT_MAX_BYTES', default=64 * 1024 * 1024)
+
+    # Scheduler coordination across worker processes:
+    #   'all'     every process runs the full tick (single-worker deployments)
+    #   'leader'  one process holds the 'tick' lease row and runs the full tick
+    #   'sharded' medications are split into SCHEDULER_SHARDS by id; workers claim shards per tick
+    scheduler_mode: str = Field(alias='SCHEDULER_MODE', default='all')
+    scheduler_shards: int = Field(alias='SCHEDULER_SHARDS', default=8)
+    scheduler_interval_minutes: int = Field(alias='SCHEDULER_INTERVAL_MINUTES', default=5)
+    scheduler_lease_seconds: int = Field(alias='SCHEDULER_LEASE_SECONDS', default=120)
+    # Dose slots are materialised this many days ahead (today included, in the owner's
+    # timezone); a medication is topped up once fewer than SCHEDULE_REFILL_DAYS remain
+    schedule_horizon_days: int = Field(alias='SCHEDULE_HORIZON_DAYS', default=7)
+    schedule_refill_days: int = Field(alias='SCHEDULE_REFILL_DAYS', default=2)
+    # Doses still 'scheduled' this long after their slot become 'missed'
+    missed_grace_minutes: int = Field(alias='MISSED_GRACE_MINUTES', default=60)
+    # In-process timer heap firing reminders/missed transitions at their exact time
+    # (modes 'all' and 'leader'; sharded deployments keep the polling sweep)
+    due_index_enabled: bool = Field(alias='DUE_INDEX_ENABLED', default=True)
+    # dose_logs keeps this many days; older rows move in batches to dose_logs_archive
+    dose_retention_days: int = Field(alias='DOSE_RETENTION_DAYS', default=90)
+    archive_batch_size: int = Field(alias='ARCHIVE_BATCH_SIZE', default=5000)
+    archive_interval_hours: int = Field(alias='ARCHIVE_INTERVAL_HOURS', default=24)
+
+    # Notification dispatch: provider 'log' (stdout) or 'file' (JSON lines, loopback for testing)
+    notify_provider: str = Field(alias='NOTIFY_PROVIDER', default='log')
+    notify_file_path: str = Field(alias='NOTIFY_FILE_PATH', default='notifications.jsonl')
+    notify_queue_size: int = Field(alias='NOTIFY_QUEUE_SIZE', default=10000)
+    notify_workers: int = Field(alias='NOTIFY_WORKERS', default=4)
+    notify_rate_per_second: float = Field(alias='NOTIFY_RATE_PER_SECOND', default=20.0)
+    notify_timeout_seconds: float = Field(alias='NOTIFY_TIMEOUT_SECONDS', default=10.0)
+    notify_max_attempts: int = Field(alias='NOTIFY_MAX_ATTEMPTS', default=5)
+    notify_backoff_seconds: float = Field(alias='NOTIFY_BACKOFF_SECONDS', default=1.0)
+    # Messages for the same user and minute arriving within this window are merged
+    notify_merge_window_seconds: float = Field(alias='NOTIFY_MERGE_WINDOW_SECONDS', default=2.0)
 
     # Azure OpenAI
     azure_openai_endpoint: str = Field(alias='AZURE_OPENAI_ENDPOINT', default='')
     azure_openai_api_key: str = Field(alias='AZURE_OPENAI_API_KEY', default='')
     azure_openai_deployment: str = Field(alias='AZURE_OPENAI_DEPLOYMENT', default='gpt-4o')
     azure_openai_api_version: str = Field(alias='AZURE_OPENAI_API_VERSION', default='2025-01-01-preview')
+    # Shared async HTTP pool for Azure OpenAI calls
+    azure_openai_timeout: float = Field(alias='AZURE_OPENAI_TIMEOUT', default=60.0)
+    azure_openai_connect_timeout: float = Field(alias='AZURE_OPENAI_CONNECT_TIMEOUT', default=5.0)
+    azure_openai_max_connections: int = Field(alias='AZURE_OPENAI_MAX_CONNECTIONS', default=100)
+    azure_openai_max_keepalive: int = Field(alias='AZURE_OPENAI_MAX_KEEPALIVE', default=20)
+    # Retries of 429/timeout/5xx made by services.llm_gateway (the SDK's own retries are off)
+    azure_openai_max_retries: int = Field(alias='AZURE_OPENAI_MAX_RETRIES', default=2)
+    # LLM gateway: concurrency per process and per user, bounded wait queue (503 beyond it),
+    # backoff between retries, and a circuit breaker that fails fast while Azure is down
+    llm_max_concurrency: int = Field(alias='LLM_MAX_CONCURRENCY', default=16)
+    llm_max_per_user: int = Field(alias='LLM_MAX_PER_USER', default=2)
+    llm_max_queue: int = Field(alias='LLM_MAX_QUEUE', default=64)
+    llm_queue_timeout_seconds: float = Field(alias='LLM_QUEUE_TIMEOUT_SECONDS', default=10.0)
+    llm_backoff_base_seconds: float = Field(alias='LLM_BACKOFF_BASE_SECONDS', default=0.5)
+    llm_backoff_max_seconds: float = Field(alias='LLM_BACKOFF_MAX_SECONDS', default=8.0)
+    llm_retry_after_max_seconds: float = Field(alias='LLM_RETRY_AFTER_MAX_SECONDS', default=20.0)
+    llm_breaker_failures: int = Field(alias='LLM_BREAKER_FAILURES', default=5)
+    llm_breaker_reset_seconds: float = Field(alias='LLM_BREAKER_RESET_SECONDS', default=30.0)
+
+    # /chat response cache: 'memory' (per process), 'redis' (shared, needs the redis package) or 'none'
+    chat_cache_backend: str = Field(alias='CHAT_CACHE_BACKEND', default='memory')
+    chat_cache_ttl_seconds: int = Field(alias='CHAT_CACHE_TTL_SECONDS', default=3600)
+    chat_cache_max_entries: int = Field(alias='CHAT_CACHE_MAX_ENTRIES', default=2048)
+    chat_cache_redis_url: str = Field(alias='CHAT_CACHE_REDIS_URL', default='redis://localhost:6379/0')
+
+    # /chat prompt: the user's medication summary is added as context when the latest
+    # question is about them (first person; other replies stay shared in the chat cache),
+    # and the conversation is trimmed (oldest turns first, replaced by a short recap)
+    # to fit the token budget
+    chat_context_summary: bool = Field(alias='CHAT_CONTEXT_SUMMARY', default=True)
+    chat_context_token_budget: int = Field(alias='CHAT_CONTEXT_TOKEN_BUDGET', default=3000)
+    chat_context_recap_tokens: int = Field(alias='CHAT_CONTEXT_RECAP_TOKENS', default=150)
+    chat_summary_max_tokens: int = Field(alias='CHAT_SUMMARY_MAX_TOKENS', default=600)
+    chat_summary_max_medications: int = Field(alias='CHAT_SUMMARY_MAX_MEDICATIONS', default=20)
+    chat_summary_cache_max_entries: int = Field(alias='CHAT_SUMMARY_CACHE_MAX_ENTRIES', default=10000)
+    # tiktoken encoding for token counts when tiktoken is installed (else ~4 characters per token)
+    chat_tokenizer_encoding: str = Field(alias='CHAT_TOKENIZER_ENCODING', default='o200k_base')
+
+    # Live reminder events (SSE). 'local' fans out within one process; 'redis' relays
+    # through pub/sub so an event raised on one worker reaches streams held by any worker
+    events_backend: str = Field(alias='EVENTS_BACKEND', default='local')
+    events_redis_url: str = Field(alias='EVENTS_REDIS_URL', default='redis://localhost:6379/0')
+    events_queue_size: int = Field(alias='EVENTS_QUEUE_SIZE', default=32)
+    events_heartbeat_seconds: float = Field(alias='EVENTS_HEARTBEAT_SECONDS', default=25.0)
+
+    # Metrics: GET /metrics requires `Authorization: Bearer <METRICS_TOKEN>` when set.
+    # SLOW_REQUEST_MS > 0 logs slower requests with the SQL they ran.
+    metrics_token: str = Field(alias='METRICS_TOKEN', default='')
+    slow_request_ms: float = Field(alias='SLOW_REQUEST_MS', default=0.0)
+    slow_request_max_statements: int = Field(alias='SLOW_REQUEST_MAX_STATEMENTS', default=100)
 
     # CORS: accept JSON array or comma-separated in .env
     cors_allow_origins: List[str] = Field(
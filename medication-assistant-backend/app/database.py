@@ -1,19 +1,155 @@
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Callable, Generator, Iterator, Sequence, TypeVar, Union
+
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 from .config import settings
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+def _engine_args(url: str) -> dict:
+    # SQLite (dev) dialects pick their own pool class and reject QueuePool sizing
+    if make_url(url).get_backend_name() == 'sqlite':
+        return dict(pool_pre_ping=True)
+    return dict(
+        pool_pre_ping=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+    )
+
+engine = create_engine(settings.database_url, **_engine_args(settings.database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def _async_url() -> str:
+    if settings.database_async_url:
+        return settings.database_async_url
+    url = make_url(settings.database_url)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+
+# Created lazily so the sync path does not need an async driver installed
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        url = _async_url()
+        _async_engine = create_async_engine(url, **_engine_args(url))
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        # expire_on_commit=False: attributes must stay loaded for serialization outside the greenlet
+        _async_sessionmaker = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker()
+
+
 class Base(DeclarativeBase):
     pass
 
 # Dependency
-from typing import Generator
+DbSession = Union[Session, AsyncSession]
 
-def get_db() -> Generator:
+def get_sync_db() -> Generator:
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if settings.db_async else get_sync_db
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncGenerator:
+    """Session of the configured kind for work outside a request (background tasks)."""
+    if settings.db_async:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+T = TypeVar('T')
+
+
+async def run_db(db: DbSession, fn: Callable[..., T], *args) -> T:
+    """Run fn(session, *args) without blocking the event loop.
+
+    Async sessions run it through AsyncSession.run_sync on the async driver; sync
+    sessions run it in Starlette's threadpool, exactly like a plain `def` route.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
+
+
+async def close_db(db: DbSession) -> None:
+    """Close a request's session early, returning its connection before a long-lived response."""
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+
+def _stream_rows_sync(stmt, render: Callable[[Sequence], str], head: str, chunk_size: int) -> Iterator[str]:
+    if head:
+        yield head
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions():
+            yield render(chunk)
+    finally:
+        db.close()
+
+
+async def _stream_rows_async(stmt, render: Callable[[Sequence], str], head: str, chunk_size: int) -> AsyncIterator[str]:
+    if head:
+        yield head
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=chunk_size))
+        async for chunk in result.partitions():
+            yield render(chunk)
+
+
+def stream_rows(stmt, render: Callable[[Sequence], str], head: str = '', chunk_size: int = 1000):
+    """StreamingResponse body: `head`, then `render(rows)` per `chunk_size` rows of `stmt`.
+
+    The statement runs on a session of its own with a server-side cursor, so memory
+    stays flat however many rows there are and the request's session can close first.
+    """
+    if settings.db_async:
+        return _stream_rows_async(stmt, render, head, chunk_size)
+    return _stream_rows_sync(stmt, render, head, chunk_size)
+
+
+def dialect_insert(db, entity):
+    """Return the dialect-specific INSERT (with on_conflict_* support) for the session's bind, or None."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(entity)
@@ -1,18 +1,42 @@
-import uvicorn
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import Base, engine
+from . import migrations
 from .config import settings
-from .routers import users, medications, adherence, chat, reminders
+from .routers import users, medications, bulk, adherence, chat, reminders, metrics
 from .services.scheduler import start as start_scheduler, shutdown as stop_scheduler
+from .services.azure_openai import close_client as close_ai_client
+from .services import events, notifier, password_hasher
+from .services.metrics import MetricsMiddleware
+
+# Importing this module touches no database and loads no SDKs: openai, APScheduler
+# and passlib are imported on first use, and all I/O happens in the lifespan below.
 
-# Create tables if they don't exist (for dev). In production, prefer Alembic migrations.
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.db_create_all:
+        # Dev convenience. In production run `python -m app.migrations` (or Alembic) once per deploy.
+        migrations.create_schema()
+    # First: the hasher's workers start before this process runs any other threads
+    password_hasher.start()
+    notifier.start()
+    await events.hub.start()
+    start_scheduler()
+    try:
+        yield
+    finally:
+        stop_scheduler()
+        await events.hub.stop()
+        notifier.shutdown()
+        await close_ai_client()
+        password_hasher.shutdown()
 
 app = FastAPI(
     title="Medication Assistant Backend",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS configuration from environment (.env)
@@ -24,22 +48,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request latency and per-request SQL counts for /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Routers
 app.include_router(users.router)
 app.include_router(medications.router)
+app.include_router(bulk.router)
 app.include_router(adherence.router)
 app.include_router(chat.router)
 app.include_router(reminders.router)
-
-# Background scheduler lifecycle
-@app.on_event("startup")
-async def _startup():
-    start_scheduler()
-
-@app.on_event("shutdown")
-async def _shutdown():
-    stop_scheduler()
+app.include_router(metrics.router)
 
 # Health & root
 @app.get("/health", tags=["system"])
@@ -51,4 +70,5 @@ async def root():
     return {"status": "ok"}
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
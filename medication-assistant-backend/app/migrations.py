@@ -0,0 +1,89 @@
+"""
+Idempotent in-place schema upgrades for databases created before a column existed.
+
+`Base.metadata.create_all` only creates missing tables; columns added to existing
+tables (and indexes on them) are handled here until the project moves to Alembic.
+Data backfills for those columns and for dose_daily_rollups run here too, once per
+deploy rather than in every worker at startup, where concurrent workers raced.
+
+The app no longer touches the schema on import; run `python -m app.migrations`
+once per deploy, or set DB_CREATE_ALL=true to do it at startup (dev).
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+# (table, column, DDL type)
+ADDED_COLUMNS = [
+    ('medications', 'weekday_mask', 'INTEGER'),
+    ('medications', 'scheduled_through', 'DATE'),
+    ('users', 'timezone', "VARCHAR(64) NOT NULL DEFAULT 'UTC'"),
+]
+
+# (index, table, columns, unique) for indexes added to existing tables
+ADDED_INDEXES = [
+    ('ix_medications_scheduled_through', 'medications', 'scheduled_through', False),
+    ('ix_dose_logs_status_scheduled_at', 'dose_logs', 'status, scheduled_at', False),
+    ('uq_dose_logs_medication_scheduled', 'dose_logs', 'medication_id, scheduled_at', True),
+]
+
+# Keeps one row per (medication_id, scheduled_at) before the unique index is built:
+# an answered row over a 'scheduled' one, then the oldest.
+DEDUPE_DOSE_LOGS = """
+DELETE FROM dose_logs WHERE id IN (
+    SELECT d.id FROM dose_logs d
+    JOIN dose_logs k ON k.medication_id = d.medication_id AND k.scheduled_at = d.scheduled_at
+    WHERE (CASE WHEN k.status = 'scheduled' THEN 1 ELSE 0 END) < (CASE WHEN d.status = 'scheduled' THEN 1 ELSE 0 END)
+       OR ((CASE WHEN k.status = 'scheduled' THEN 1 ELSE 0 END) = (CASE WHEN d.status = 'scheduled' THEN 1 ELSE 0 END)
+           AND k.id < d.id)
+)
+"""
+
+
+def _index_names(insp, table: str) -> set[str]:
+    # create_all makes the unique constraint a table constraint, not a named index, on SQLite
+    names = {i['name'] for i in insp.get_indexes(table)}
+    return names | {c['name'] for c in insp.get_unique_constraints(table)}
+
+
+def upgrade(engine: Engine) -> None:
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl_type in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if column not in {c['name'] for c in insp.get_columns(table)}:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+        for name, table, columns, unique in ADDED_INDEXES:
+            if table not in tables or name in _index_names(insp, table):
+                continue
+            if name == 'uq_dose_logs_medication_scheduled':
+                if conn.execute(text(DEDUPE_DOSE_LOGS)).rowcount and 'dose_daily_rollups' in tables:
+                    # Counted the duplicates too; emptied, it is rebuilt by backfill() below
+                    conn.execute(text('DELETE FROM dose_daily_rollups'))
+            conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def backfill() -> None:
+    """Fill derived data for rows written before it existed: schedule columns, then the rollup."""
+    from .database import SessionLocal
+    from .services import adherence_rollup, schedule
+    db = SessionLocal()
+    try:
+        schedule.backfill(db)
+        adherence_rollup.backfill(db)
+    finally:
+        db.close()
+
+
+def create_schema() -> None:
+    """Create missing tables, apply the column upgrades above, then the data backfills."""
+    from .database import Base, engine
+    from . import models  # noqa: F401  (registers the tables on Base.metadata)
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+    backfill()
+
+
+if __name__ == '__main__':
+    create_schema()
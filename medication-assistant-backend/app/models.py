@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, Index, Text, UniqueConstraint
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from datetime import datetime
+from datetime import date, datetime
 from .database import Base
 
 class User(Base):
@@ -10,6 +10,7 @@ class User(Base):
     hashed_password: Mapped[str] = mapped_column(String(255), nullable=False)
     full_name: Mapped[str | None] = mapped_column(String(255), default=None)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    timezone: Mapped[str] = mapped_column(String(64), default='UTC', nullable=False)  # IANA name; dose times are local to it
 
     medications = relationship('Medication', back_populates='owner', cascade='all, delete')
 
@@ -24,12 +25,30 @@ class Medication(Base):
     end_date: Mapped[datetime | None] = mapped_column(Date, default=None)
     times_of_day: Mapped[str] = mapped_column(Text, default='[]')  # JSON list of 'HH:MM'
     days_of_week: Mapped[str] = mapped_column(String(32), default='all')  # 'all' or comma of 0-6
+    # Compact form of the two fields above, maintained by services.schedule.apply_schedule
+    weekday_mask: Mapped[int | None] = mapped_column(Integer, default=None)  # bit N = weekday N (Mon=0)
+    # Last local date whose dose slots are materialised; NULL until the scheduler first runs for it
+    scheduled_through: Mapped[date | None] = mapped_column(Date, default=None, index=True)
 
     owner = relationship('User', back_populates='medications')
     doses = relationship('DoseLog', back_populates='medication', cascade='all, delete')
+    daily_rollups = relationship('DoseDailyRollup', cascade='all, delete')
+    times = relationship('MedicationTime', cascade='all, delete-orphan', order_by='MedicationTime.minute_of_day')
+    archived_doses = relationship('DoseLogArchive', cascade='all, delete')
+
+class MedicationTime(Base):
+    __tablename__ = 'medication_times'
+    medication_id: Mapped[int] = mapped_column(ForeignKey('medications.id', ondelete='CASCADE'), primary_key=True)
+    minute_of_day: Mapped[int] = mapped_column(Integer, primary_key=True)  # 0..1439
 
 class DoseLog(Base):
     __tablename__ = 'dose_logs'
+    # One row per medication slot; lets the scheduler insert with ON CONFLICT DO NOTHING
+    __table_args__ = (
+        UniqueConstraint('medication_id', 'scheduled_at', name='uq_dose_logs_medication_scheduled'),
+        # Serves the missed-dose sweep (status='scheduled' AND scheduled_at < cutoff) from the index alone
+        Index('ix_dose_logs_status_scheduled_at', 'status', 'scheduled_at'),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     medication_id: Mapped[int] = mapped_column(ForeignKey('medications.id', ondelete='CASCADE'))
     scheduled_at: Mapped[datetime] = mapped_column(DateTime, index=True)
@@ -38,3 +57,43 @@ class DoseLog(Base):
     notes: Mapped[str | None] = mapped_column(Text, default=None)
 
     medication = relationship('Medication', back_populates='doses')
+
+class DoseLogArchive(Base):
+    """DoseLog rows older than DOSE_RETENTION_DAYS, moved here by services.archive (ids are preserved)."""
+    __tablename__ = 'dose_logs_archive'
+    __table_args__ = (
+        Index('ix_dose_logs_archive_medication_scheduled', 'medication_id', 'scheduled_at'),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    medication_id: Mapped[int] = mapped_column(ForeignKey('medications.id', ondelete='CASCADE'))
+    scheduled_at: Mapped[datetime] = mapped_column(DateTime)
+    taken_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+    status: Mapped[str] = mapped_column(String(32))
+    notes: Mapped[str | None] = mapped_column(Text, default=None)
+
+class DoseDailyRollup(Base):
+    """Per-medication, per-day dose counters maintained incrementally for /adherence/stats."""
+    __tablename__ = 'dose_daily_rollups'
+    __table_args__ = (
+        Index('ix_dose_daily_rollups_user_day', 'user_id', 'day'),
+    )
+    medication_id: Mapped[int] = mapped_column(ForeignKey('medications.id', ondelete='CASCADE'), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)  # date part of DoseLog.scheduled_at
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+    scheduled: Mapped[int] = mapped_column(Integer, default=0)
+    taken: Mapped[int] = mapped_column(Integer, default=0)
+    missed: Mapped[int] = mapped_column(Integer, default=0)
+    skipped: Mapped[int] = mapped_column(Integer, default=0)
+
+class SchedulerLease(Base):
+    """Time-bounded ownership of a scheduler task ('tick' or 'tick:<shard>') by one worker process."""
+    __tablename__ = 'scheduler_leases'
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(128), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class UserDataVersion(Base):
+    """Per-user counter bumped on any medication/dose change; source of listing ETags."""
+    __tablename__ = 'user_data_versions'
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
@@ -1,22 +1,48 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from typing import Literal
 
-from ..database import get_db
+from ..database import DbSession, get_db, run_db
 from ..auth import get_current_user
-from .. import models, schemas
+from .. import schemas
+from ..services import adherence_rollup, analytics, versions
 
 router = APIRouter(prefix='/adherence', tags=['adherence'])
 
+def _counts(db: Session, user_id: int, since: datetime) -> dict:
+    # Daily rollup rows cover whole days; fall back to one aggregate over dose_logs if none exist yet.
+    # Both stop at the end of today (UTC): later days hold the materialised schedule ahead.
+    until = datetime.utcnow().date() + timedelta(days=1)
+    counts = adherence_rollup.summarize(db, user_id, since.date(), until)
+    if counts is None:
+        counts = adherence_rollup.aggregate(db, user_id, since, datetime.combine(until, time.min))
+    return counts
+
 @router.get('/stats', response_model=schemas.AdherenceStats)
-def get_stats(period_days: int = 30, db: Session = Depends(get_db), user=Depends(get_current_user)):
+async def get_stats(period_days: int = 30, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
     since = datetime.utcnow() - timedelta(days=period_days)
-    q = db.query(models.DoseLog).join(models.Medication).filter(
-        models.Medication.user_id == user.id,
-        models.DoseLog.scheduled_at >= since,
-    )
-    scheduled = q.count()
-    taken = q.filter(models.DoseLog.status == 'taken').count()
-    missed = q.filter(models.DoseLog.status == 'missed').count()
+    counts = await run_db(db, _counts, user.id, since)
+    scheduled, taken, missed = counts['scheduled'], counts['taken'], counts['missed']
     rate = (taken / scheduled * 100.0) if scheduled else 0.0
     return schemas.AdherenceStats(period_days=period_days, scheduled=scheduled, taken=taken, missed=missed, adherence_rate=round(rate, 2))
+
+@router.get('/analytics', response_model=schemas.AdherenceAnalytics)
+async def get_analytics(
+    period_days: int = Query(90, ge=1, le=730),
+    interval: Literal['day', 'week', 'month'] = 'week',
+    db: DbSession = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """Streaks, lateness, weekday/hour patterns and trend; cached until the user's data changes."""
+    key = (user.id, period_days, interval)
+    # The window moves at midnight even when nothing was written
+    stamp = (await run_db(db, versions.current, user.id), datetime.utcnow().date())
+    result = analytics.cache.get(key, stamp)
+    if result is None:
+        fetched = await run_db(db, analytics.fetch, user.id, analytics.since_for(period_days))
+        # NumPy work runs off the event loop in both session modes
+        result = await run_in_threadpool(analytics.compute, fetched, period_days, interval)
+        analytics.cache.set(key, stamp, result)
+    return result
@@ -0,0 +1,283 @@
+"""
+Bulk import/export of a user's medications and dose history, as CSV or NDJSON.
+
+Import reads the request body into a spooled temporary file, then validates it
+CHUNK_SIZE rows at a time with schemas.MedicationCreate (one pydantic call per
+chunk) and inserts each chunk with executemany: medications with RETURNING for
+their ids, then their medication_times rows, one commit per chunk. Rows that fail
+validation are reported by number (1-based data rows: the CSV header and blank
+lines are not counted) and the rest of the chunk is still imported. Imported
+medications get their doses from the next scheduler tick.
+
+CSV columns are name, dosage, notes, start_date, end_date, times_of_day and
+days_of_week; times_of_day is separated by ';' (e.g. "08:00;20:00") and
+days_of_week is 'all' or weekday numbers (0 = Monday) separated by ',' or ';'.
+Exports use the same layout, so an exported file imports as is.
+
+Exports stream through database.stream_rows with constant memory.
+"""
+import csv
+import io
+import json
+import re
+import tempfile
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..auth import get_current_user
+from ..config import settings
+from ..database import DbSession, get_db, run_db, stream_rows
+from ..services import archive, events, schedule, versions
+
+router = APIRouter(prefix='/bulk', tags=['bulk'])
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+SPOOL_MEMORY_BYTES = 1 << 20  # larger uploads spill to disk
+
+MEDICATION_FIELDS = ('name', 'dosage', 'notes', 'start_date', 'end_date', 'times_of_day', 'days_of_week')
+DOSE_FIELDS = ('medication_id', 'medication_name', 'id', 'scheduled_at', 'taken_at', 'status', 'notes')
+MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+_SEPARATORS = re.compile(r'[;,\s]+')
+
+_medications = TypeAdapter(List[schemas.MedicationCreate])
+
+Format = Literal['csv', 'ndjson']
+
+
+class _Unparsable:
+    def __init__(self, error: str):
+        self.error = error
+
+
+# ---- import ----
+
+def _import_format(format: Optional[str], content_type: Optional[str]) -> str:
+    if format:
+        return format
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json-lines'):
+        return 'ndjson'
+    raise HTTPException(415, 'Send text/csv or application/x-ndjson, or pass format=csv|ndjson')
+
+
+async def _spool(request: Request):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.bulk_import_max_bytes:
+            spool.close()
+            raise HTTPException(413, f'Import body exceeds {settings.bulk_import_max_bytes} bytes')
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _csv_records(text) -> Iterator:
+    reader = csv.DictReader(text)
+    missing = {'name', 'dosage'} - set(reader.fieldnames or ())
+    if missing:
+        raise HTTPException(400, f"CSV header must include: {', '.join(sorted(missing))}")
+    for record in reader:
+        row = {k: v.strip() for k, v in record.items() if k in MEDICATION_FIELDS and v and v.strip()}
+        if 'times_of_day' in row:
+            row['times_of_day'] = [t for t in _SEPARATORS.split(row['times_of_day']) if t]
+        if 'days_of_week' in row:
+            row['days_of_week'] = ','.join(d for d in _SEPARATORS.split(row['days_of_week']) if d)
+        yield row
+
+
+def _ndjson_records(text) -> Iterator:
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield _Unparsable(f'invalid JSON: {e}')
+
+
+def _records(spool, format: str) -> Iterator[tuple[int, object]]:
+    # utf-8-sig drops the byte-order mark spreadsheet exports start with
+    text = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='' if format == 'csv' else None)
+    records = _csv_records(text) if format == 'csv' else _ndjson_records(text)
+    return enumerate(records, start=1)
+
+
+def _error_message(error: dict) -> str:
+    field = '.'.join(str(part) for part in error['loc'][1:])
+    return f"{field}: {error['msg']}" if field else error['msg']
+
+
+def _next_chunk(records: Iterator[tuple[int, object]]) -> tuple[int, list, list[dict]]:
+    """Read and validate up to CHUNK_SIZE records: (rows read, valid medications, row errors)."""
+    try:
+        batch = list(islice(records, CHUNK_SIZE))
+    except UnicodeDecodeError:
+        raise HTTPException(400, 'Import body must be UTF-8')
+    except csv.Error as e:
+        raise HTTPException(400, f'Malformed CSV: {e}')
+    errors = [{'row': n, 'errors': [r.error]} for n, r in batch if isinstance(r, _Unparsable)]
+    candidates = [(n, r) for n, r in batch if not isinstance(r, _Unparsable)]
+    try:
+        valid = _medications.validate_python([r for _, r in candidates])
+    except ValidationError as e:
+        # One pass finds every bad row in the chunk; the remainder then validates cleanly
+        bad: dict[int, list[str]] = {}
+        for error in e.errors():
+            bad.setdefault(error['loc'][0], []).append(_error_message(error))
+        errors += [{'row': candidates[i][0], 'errors': msgs} for i, msgs in bad.items()]
+        valid = _medications.validate_python([r for i, (_, r) in enumerate(candidates) if i not in bad])
+    errors.sort(key=lambda e: e['row'])
+    return len(batch), valid, errors
+
+
+def _insert_medications(db: Session, user_id: int, meds: List[schemas.MedicationCreate]) -> None:
+    # Ordered RETURNING is batched on PostgreSQL but falls back to one INSERT per row
+    # on SQLite. There ids come back unordered instead: a statement's new rowids are
+    # max(rowid)+1 onwards in row order, so sorting them restores the row order.
+    ordered = db.get_bind().dialect.name != 'sqlite'
+    ids = db.execute(
+        insert(models.Medication.__table__).returning(models.Medication.id, sort_by_parameter_order=ordered),
+        [{
+            'user_id': user_id, 'name': m.name, 'dosage': m.dosage, 'notes': m.notes,
+            'start_date': m.start_date, 'end_date': m.end_date,
+            'times_of_day': json.dumps(m.times_of_day), 'days_of_week': m.days_of_week,
+            'weekday_mask': schedule.weekday_mask(m.days_of_week),
+        } for m in meds],
+    ).scalars().all()
+    if not ordered:
+        ids = sorted(ids)
+    times = [
+        {'medication_id': med_id, 'minute_of_day': minute}
+        for med_id, m in zip(ids, meds)
+        for minute in schedule.minutes_of_day(m.times_of_day)
+    ]
+    if times:
+        db.execute(insert(models.MedicationTime.__table__), times)
+    versions.bump(db, [user_id])
+    db.commit()
+
+
+@router.post('/medications', response_model=schemas.BulkImportResult)
+async def import_medications(
+    request: Request,
+    format: Optional[Format] = None,
+    dry_run: bool = False,
+    db: DbSession = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """
+    Create medications from a CSV or NDJSON body (format from `format` or the
+    Content-Type). Valid rows are committed chunk by chunk; invalid rows are listed
+    in `errors` (the first MAX_REPORTED_ERRORS) and skipped. `dry_run` validates only.
+    """
+    fmt = _import_format(format, request.headers.get('content-type'))
+    spool = await _spool(request)
+    received = imported = failed = 0
+    errors: list[dict] = []
+    try:
+        records = _records(spool, fmt)
+        while True:
+            # Parsing and validation are CPU work: off the event loop in both session modes
+            count, valid, chunk_errors = await run_in_threadpool(_next_chunk, records)
+            if not count:
+                break
+            received += count
+            failed += len(chunk_errors)
+            errors += chunk_errors[:MAX_REPORTED_ERRORS - len(errors)]
+            if valid and not dry_run:
+                await run_db(db, _insert_medications, user.id, valid)
+            imported += len(valid)
+    finally:
+        spool.close()
+    if imported and not dry_run:
+        events.publish(user.id, events.SCHEDULE_CHANGED, action='imported', count=imported)
+    return schemas.BulkImportResult(
+        received=received, imported=imported, failed=failed, dry_run=dry_run,
+        errors=errors, errors_truncated=failed > len(errors),
+    )
+
+
+# ---- export ----
+
+def _value(v) -> str:
+    if v is None:
+        return ''
+    return v.isoformat() if hasattr(v, 'isoformat') else str(v)
+
+
+def _csv_chunk(rows) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerows([_value(v) for v in row] for row in rows)
+    return out.getvalue()
+
+
+def _ndjson_chunk(fields, rows) -> str:
+    return ''.join(json.dumps({k: v.isoformat() if hasattr(v, 'isoformat') else v for k, v in zip(fields, row)}) + '\n'
+                   for row in rows)
+
+
+def _medication_rows(format: str, rows) -> str:
+    # times_of_day is stored as JSON: ';'-joined in CSV, a list in NDJSON
+    rows = [(*row[:6], json.loads(row[6] or '[]'), row[7]) for row in rows]
+    if format == 'csv':
+        return _csv_chunk((*row[:6], ';'.join(row[6]), row[7]) for row in rows)
+    return _ndjson_chunk(('id', *MEDICATION_FIELDS), rows)
+
+
+def _export(format: str, name: str, fields, stmt, render) -> StreamingResponse:
+    head = ','.join(fields) + '\n' if format == 'csv' else ''
+    return StreamingResponse(
+        stream_rows(stmt, render, head=head, chunk_size=CHUNK_SIZE),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{name}.{format}"'},
+    )
+
+
+@router.get('/medications')
+async def export_medications(format: Format = 'csv', user=Depends(get_current_user)):
+    """All of the user's medications, oldest first."""
+    m = models.Medication
+    stmt = (
+        select(m.id, m.name, m.dosage, m.notes, m.start_date, m.end_date, m.times_of_day, m.days_of_week)
+        .where(m.user_id == user.id)
+        .order_by(m.id)
+    )
+    return _export(format, 'medications', ('id', *MEDICATION_FIELDS), stmt,
+                   lambda rows: _medication_rows(format, rows))
+
+
+@router.get('/doses')
+async def export_doses(
+    format: Format = 'csv',
+    days: Optional[int] = Query(None, ge=1, description='only the last N days; full history (archive included) when omitted'),
+    user=Depends(get_current_user),
+):
+    """The user's dose history ordered by medication, then time."""
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    doses = archive.dose_source(since)
+    stmt = (
+        select(doses.c.medication_id, models.Medication.name, doses.c.id, doses.c.scheduled_at,
+               doses.c.taken_at, doses.c.status, doses.c.notes)
+        .join(models.Medication, models.Medication.id == doses.c.medication_id)
+        .where(models.Medication.user_id == user.id)
+        .order_by(doses.c.medication_id, doses.c.scheduled_at, doses.c.id)
+    )
+    if since is not None:
+        stmt = stmt.where(doses.c.scheduled_at >= since)
+    render = _csv_chunk if format == 'csv' else lambda rows: _ndjson_chunk(DOSE_FIELDS, rows)
+    return _export(format, 'doses', DOSE_FIELDS, stmt, render)
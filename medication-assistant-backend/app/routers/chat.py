@@ -1,7 +1,15 @@
-from fastapi import APIRouter, Depends
+import json
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from ..auth import get_current_user
+from ..config import settings
+from ..database import DbSession, close_db, get_db, run_db
 from .. import schemas
-from ..services.azure_openai import chat as ai_chat
+from ..services import chat_context
+from ..services.llm_gateway import chat_stream as ai_chat_stream, gateway
+from ..services.metrics import observe_prompt
+from ..services.chat_cache import cached_chat
 
 router = APIRouter(prefix='/chat', tags=['chat'])
 
@@ -14,8 +22,56 @@ SYSTEM_PROMPT = {
     ),
 }
 
+async def _prompt(db: DbSession, user_id: int, req: schemas.ChatRequest, endpoint: str) -> tuple[list[dict], bool]:
+    """System prompt, the user's summary when the question is about them, and as much
+    recent history as the budget allows.
+
+    The session is closed before returning so no pooled connection is held during
+    the model call. Returns (messages, personalized).
+    """
+    history = [m.model_dump() for m in req.messages]
+    personalized = settings.chat_context_summary and chat_context.needs_summary(history)
+    fixed = [SYSTEM_PROMPT]
+    if personalized:
+        fixed.append(chat_context.summary_message(await run_db(db, chat_context.user_summary, user_id)))
+    await close_db(db)
+    messages, tokens, dropped = chat_context.fit_history(fixed, history)
+    observe_prompt(endpoint, tokens, dropped)
+    return messages, personalized
+
 @router.post('', response_model=schemas.ChatResponse)
-async def chat(req: schemas.ChatRequest, user=Depends(get_current_user)):
-    messages = [SYSTEM_PROMPT] + [m.model_dump() for m in req.messages]
-    reply = await ai_chat(messages)
+async def chat(req: schemas.ChatRequest, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    messages, personalized = await _prompt(db, user.id, req, 'chat')
+    # With the user's summary in the prompt, replies may only be reused for that user
+    reply = await cached_chat(messages, user_id=user.id if personalized else None, caller_id=user.id)
     return schemas.ChatResponse(reply=reply)
+
+@router.post('/stream')
+async def chat_stream(req: schemas.ChatRequest, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    """
+    Server-Sent Events variant of POST /chat.
+    Emits `data: {"delta": "..."}` per token batch, then `data: [DONE]`;
+    upstream failures arrive as a final `event: error` frame (503 up front
+    while the gateway is saturated or its circuit is open).
+    """
+    messages, _ = await _prompt(db, user.id, req, 'chat_stream')
+    # Refuse with a plain 503 while the gateway would reject the call, before the stream starts
+    gateway.admit()
+
+    async def events():
+        try:
+            async for delta in ai_chat_stream(messages, user.id):
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except HTTPException as e:
+            yield f"event: error\ndata: {json.dumps({'detail': e.detail, 'status': e.status_code})}\n\n"
+            return
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'AI error: {e}'})}\n\n"
+            return
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -1,88 +1,258 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, select, tuple_, update
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional
+import base64
 import json
 from datetime import datetime, date, timedelta
 
 from .. import models, schemas
-from ..database import get_db
+from ..database import DbSession, get_db, run_db, stream_rows
 from ..auth import get_current_user
+from ..services import adherence_rollup, archive, due_index, events, schedule, scheduler, versions
 
 router = APIRouter(prefix='/medications', tags=['medications'])
 
-@router.post('', response_model=schemas.MedicationOut)
-def create_med(payload: schemas.MedicationCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
+# Route handlers are async and hand their DB work to run_db, which runs the
+# helpers below on the async driver (DB_ASYNC=true) or in the threadpool.
+
+def _get_owned_med(db: Session, user_id: int, med_id: int) -> models.Medication:
+    med = db.query(models.Medication).filter(models.Medication.id == med_id, models.Medication.user_id == user_id).first()
+    if not med:
+        raise HTTPException(404, 'Not found')
+    return med
+
+def _create_med(db: Session, user_id: int, payload: schemas.MedicationCreate) -> models.Medication:
     med = models.Medication(
-        user_id=user.id,
+        user_id=user_id,
         name=payload.name,
         dosage=payload.dosage,
         notes=payload.notes,
         start_date=payload.start_date,
         end_date=payload.end_date,
-        times_of_day=json.dumps(payload.times_of_day),
-        days_of_week=payload.days_of_week,
     )
+    schedule.apply_schedule(med, payload.times_of_day, payload.days_of_week)
     db.add(med)
+    versions.bump(db, [user_id])
     db.commit()
+    scheduler.generate_schedules(db, medication_ids=[med.id])
     db.refresh(med)
+    events.publish(user_id, events.SCHEDULE_CHANGED, medication_id=med.id, action='created')
     return med
 
-@router.get('', response_model=List[schemas.MedicationOut])
-def list_meds(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    meds = db.query(models.Medication).filter(models.Medication.user_id == user.id).all()
-    return meds
+def _list_meds(db: Session, user_id: int) -> List[models.Medication]:
+    return db.query(models.Medication).filter(models.Medication.user_id == user_id).all()
 
-@router.get('/{med_id}', response_model=schemas.MedicationOut)
-def get_med(med_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    med = db.query(models.Medication).filter(models.Medication.id == med_id, models.Medication.user_id == user.id).first()
-    if not med:
-        raise HTTPException(404, 'Not found')
-    return med
+def _schedule_key(med: models.Medication) -> tuple:
+    return med.times_of_day, med.days_of_week, med.start_date, med.end_date
 
-@router.put('/{med_id}', response_model=schemas.MedicationOut)
-def update_med(med_id: int, payload: schemas.MedicationUpdate, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    med = db.query(models.Medication).filter(models.Medication.id == med_id, models.Medication.user_id == user.id).first()
-    if not med:
-        raise HTTPException(404, 'Not found')
+def _update_med(db: Session, user_id: int, med_id: int, payload: schemas.MedicationUpdate) -> models.Medication:
+    med = _get_owned_med(db, user_id, med_id)
+    before = _schedule_key(med)
     med.name = payload.name
     med.dosage = payload.dosage
     med.notes = payload.notes
     med.start_date = payload.start_date
     med.end_date = payload.end_date
-    med.times_of_day = json.dumps(payload.times_of_day)
-    med.days_of_week = payload.days_of_week
+    schedule.apply_schedule(med, payload.times_of_day, payload.days_of_week)
+    rescheduled = _schedule_key(med) != before
+    if rescheduled:
+        # Only the doses still ahead and unanswered follow the new schedule
+        scheduler.clear_future_doses(db, [med.id])
+    versions.bump(db, [user_id])
     db.commit()
+    due_index.reload_medication(db, med.id)
+    if rescheduled:
+        scheduler.generate_schedules(db, medication_ids=[med.id])
     db.refresh(med)
+    events.publish(user_id, events.SCHEDULE_CHANGED, medication_id=med.id, action='updated')
     return med
 
-@router.delete('/{med_id}')
-def delete_med(med_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    med = db.query(models.Medication).filter(models.Medication.id == med_id, models.Medication.user_id == user.id).first()
-    if not med:
-        raise HTTPException(404, 'Not found')
+def _delete_med(db: Session, user_id: int, med_id: int) -> None:
+    med = _get_owned_med(db, user_id, med_id)
     db.delete(med)
+    versions.bump(db, [user_id])
     db.commit()
-    return {"status": "deleted"}
+    due_index.cancel_medication(med_id)
+    events.publish(user_id, events.SCHEDULE_CHANGED, medication_id=med_id, action='deleted')
 
-@router.post('/{med_id}/doses/{dose_id}/take')
-def take_dose(med_id: int, dose_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def _take_dose(db: Session, user_id: int, med_id: int, dose_id: int) -> None:
     dose = db.query(models.DoseLog).join(models.Medication).filter(
         models.DoseLog.id == dose_id,
-        models.Medication.user_id == user.id,
+        models.Medication.user_id == user_id,
         models.Medication.id == med_id,
     ).first()
     if not dose:
         raise HTTPException(404, 'Dose not found')
+    scheduled_at = dose.scheduled_at
+    deltas = adherence_rollup.new_deltas()
+    adherence_rollup.track(deltas, user_id, med_id, scheduled_at, dose.status, 'taken')
     dose.status = 'taken'
     dose.taken_at = datetime.utcnow()
+    adherence_rollup.apply(db, deltas)
+    versions.bump(db, [user_id])
     db.commit()
+    due_index.cancel_dose(dose_id, scheduled_at)
+
+def _apply_dose_batch(db: Session, user_id: int, items: List[schemas.DoseStatusUpdate]) -> schemas.DoseBatchResponse:
+    # Last write wins for a dose listed more than once
+    wanted = {item.dose_id: item for item in items}
+    owned = db.execute(
+        select(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at, models.DoseLog.status)
+        .join(models.Medication)
+        .where(models.DoseLog.id.in_(wanted), models.Medication.user_id == user_id)
+    ).all()
+
+    now = datetime.utcnow()
+    deltas = adherence_rollup.new_deltas()
+    new_status, new_taken_at = {}, {}
+    for dose_id, med_id, scheduled_at, old_status in owned:
+        item = wanted[dose_id]
+        new_status[dose_id] = item.status
+        new_taken_at[dose_id] = (item.taken_at or now) if item.status == 'taken' else None
+        adherence_rollup.track(deltas, user_id, med_id, scheduled_at, old_status, item.status)
+
+    if owned:
+        # One UPDATE for the whole batch, values picked per id with CASE
+        db.execute(
+            update(models.DoseLog)
+            .where(models.DoseLog.id.in_(new_status))
+            .values(
+                status=case(new_status, value=models.DoseLog.id),
+                # The column as ELSE (never reached) types the CASE as a timestamp on
+                # Postgres even when every branch is NULL (an all-skipped batch)
+                taken_at=case(new_taken_at, value=models.DoseLog.id, else_=models.DoseLog.taken_at),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        adherence_rollup.apply(db, deltas)
+        versions.bump(db, [user_id])
+        db.commit()
+        for dose_id, _, scheduled_at, _ in owned:
+            due_index.cancel_dose(dose_id, scheduled_at)
+
+    return schemas.DoseBatchResponse(results=[
+        schemas.DoseBatchResult(dose_id=item.dose_id, ok=True, status=item.status)
+        if item.dose_id in new_status
+        else schemas.DoseBatchResult(dose_id=item.dose_id, ok=False, error='Dose not found')
+        for item in items
+    ])
+
+# Dose history paging/streaming: keyset on (scheduled_at, id) rides the
+# (medication_id, scheduled_at) indexes; NDJSON rows skip ORM hydration.
+# Windows older than DOSE_RETENTION_DAYS also read dose_logs_archive.
+STREAM_CHUNK_SIZE = 1000
+
+def _encode_cursor(scheduled_at: datetime, dose_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{scheduled_at.isoformat()}|{dose_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        at, dose_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(at), int(dose_id)
+    except ValueError:
+        raise HTTPException(400, 'Invalid cursor')
+
+def _doses_query(med_id: int, days: int, cursor: Optional[str]):
+    since = datetime.utcnow() - timedelta(days=days)
+    doses = archive.dose_source(since)
+    stmt = select(doses.c.id, doses.c.scheduled_at, doses.c.taken_at, doses.c.status, doses.c.notes).where(
+        doses.c.medication_id == med_id, doses.c.scheduled_at >= since,
+    )
+    if cursor:
+        stmt = stmt.where(tuple_(doses.c.scheduled_at, doses.c.id) > tuple_(*_decode_cursor(cursor)))
+    return stmt.order_by(doses.c.scheduled_at.asc(), doses.c.id.asc())
+
+def _list_doses(db: Session, user_id: int, med_id: int, days: int, limit: Optional[int], cursor: Optional[str]):
+    med = _get_owned_med(db, user_id, med_id)
+    stmt = _doses_query(med.id, days, cursor)
+    if limit is None:
+        return db.execute(stmt).mappings().all(), None
+    rows = db.execute(stmt.limit(limit + 1)).mappings().all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], _encode_cursor(last['scheduled_at'], last['id'])
+
+def _dose_line(row) -> str:
+    dose_id, scheduled_at, taken_at, status, notes = row
+    return json.dumps({
+        'id': dose_id,
+        'scheduled_at': scheduled_at.isoformat(),
+        'taken_at': taken_at.isoformat() if taken_at else None,
+        'status': status,
+        'notes': notes,
+    }) + '\n'
+
+@router.post('', response_model=schemas.MedicationOut)
+async def create_med(payload: schemas.MedicationCreate, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    return await run_db(db, _create_med, user.id, payload)
+
+@router.get('', response_model=List[schemas.MedicationOut])
+async def list_meds(request: Request, response: Response, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    etag = await run_db(db, versions.etag, user.id, 'medications')
+    if versions.not_modified(request, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return await run_db(db, _list_meds, user.id)
+
+@router.get('/{med_id}', response_model=schemas.MedicationOut)
+async def get_med(med_id: int, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    return await run_db(db, _get_owned_med, user.id, med_id)
+
+@router.put('/{med_id}', response_model=schemas.MedicationOut)
+async def update_med(med_id: int, payload: schemas.MedicationUpdate, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    return await run_db(db, _update_med, user.id, med_id, payload)
+
+@router.delete('/{med_id}')
+async def delete_med(med_id: int, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    await run_db(db, _delete_med, user.id, med_id)
+    return {"status": "deleted"}
+
+@router.post('/{med_id}/doses/{dose_id}/take')
+async def take_dose(med_id: int, dose_id: int, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    await run_db(db, _take_dose, user.id, med_id, dose_id)
     return {"status": "taken"}
 
+@router.post('/doses/batch', response_model=schemas.DoseBatchResponse)
+async def update_doses(payload: schemas.DoseBatchRequest, db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    """Apply many take/skip actions (e.g. an offline re-sync) with one ownership query and one UPDATE."""
+    return await run_db(db, _apply_dose_batch, user.id, payload.items)
+
 @router.get('/{med_id}/doses', response_model=List[schemas.DoseLogOut])
-def list_doses(med_id: int, days: int = 7, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    med = db.query(models.Medication).filter(models.Medication.id == med_id, models.Medication.user_id == user.id).first()
-    if not med:
-        raise HTTPException(404, 'Not found')
-    since = datetime.utcnow() - timedelta(days=days)
-    doses = db.query(models.DoseLog).filter(models.DoseLog.medication_id == med.id, models.DoseLog.scheduled_at >= since).order_by(models.DoseLog.scheduled_at.asc()).all()
-    return doses
+async def list_doses(
+    request: Request,
+    response: Response,
+    med_id: int,
+    days: int = 7,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: Literal['json', 'ndjson'] = 'json',
+    db: DbSession = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """
+    Without `limit` returns the whole window as before. With `limit`, pages are
+    keyset-ordered by (scheduled_at, id); pass the `X-Next-Cursor` header back as
+    `cursor`. `format=ndjson` streams one JSON object per line with flat memory.
+    Responses carry an ETag from the user's data version; the window start is
+    rounded to the hour so the tag stays stable between changes.
+    """
+    window = (datetime.utcnow() - timedelta(days=days)).strftime('%Y%m%d%H')
+    etag = await run_db(db, versions.etag, user.id, 'doses', med_id, window, limit, cursor, format)
+    if versions.not_modified(request, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if format == 'ndjson':
+        await run_db(db, _get_owned_med, user.id, med_id)
+        # The stream opens its own session: the request session closes before the body is sent
+        body = stream_rows(_doses_query(med_id, days, cursor), lambda chunk: ''.join(_dose_line(row) for row in chunk),
+                           chunk_size=STREAM_CHUNK_SIZE)
+        return StreamingResponse(body, media_type='application/x-ndjson', headers=headers)
+    response.headers.update(headers)
+    rows, next_cursor = await run_db(db, _list_doses, user.id, med_id, days, limit, cursor)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return rows
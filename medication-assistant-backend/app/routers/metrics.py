@@ -0,0 +1,17 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from ..config import settings
+from ..services import metrics
+
+router = APIRouter(tags=['system'])
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics(authorization: Optional[str] = Header(default=None)):
+    # Scrapers don't log in; METRICS_TOKEN (if set) is a static bearer token instead of a user JWT
+    if settings.metrics_token and not secrets.compare_digest(authorization or '', f'Bearer {settings.metrics_token}'):
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, 'Invalid metrics token')
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
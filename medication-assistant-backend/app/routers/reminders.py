@@ -1,13 +1,53 @@
+import asyncio
+import json
+
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import DbSession, close_db, get_db, run_db
 from ..auth import get_current_user
-from ..services.scheduler import generate_todays_schedules, check_missed_doses
+from ..config import settings
+from ..services import events
+from ..services.scheduler import generate_schedules, check_missed_doses
 
 router = APIRouter(prefix='/reminders', tags=['reminders'])
 
+def _sync(db: Session, user_id: int) -> None:
+    # Only the caller's medications; the scheduler tick covers everyone else
+    generate_schedules(db, user_id=user_id)
+    check_missed_doses(db, user_id=user_id)
+
 @router.post('/sync')
-def sync(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    generate_todays_schedules(db)
-    check_missed_doses(db)
+async def sync(db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    await run_db(db, _sync, user.id)
     return {"status": "ok"}
+
+@router.get('/events')
+async def event_stream(db: DbSession = Depends(get_db), user=Depends(get_current_user)):
+    """Server-sent events for the caller: dose_due, dose_missed and schedule_changed.
+
+    Replaces polling /reminders/sync. Comment lines are sent as heartbeats so idle
+    connections survive proxies; clients should refetch what they show on reconnect.
+    """
+    # The stream can stay open for hours: hand the request's DB connection back now
+    await close_db(db)
+    queue = events.subscribe(user.id)
+
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.events_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            events.unsubscribe(user.id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -1,30 +1,93 @@
-from fastapi import APIRouter, Depends, HTTPException
+import time
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from typing import Optional
 from .. import models, schemas
-from ..database import get_db
-from ..auth import get_password_hash, verify_password, create_access_token, get_current_user
+from ..database import DbSession, get_db, run_db, session_scope
+from ..auth import create_access_token, get_current_user, password_needs_rehash
+from ..services import due_index, password_hasher, scheduler, versions
 
 router = APIRouter(prefix='/auth', tags=['auth'])
 
-@router.post('/register', response_model=schemas.UserOut)
-def register(payload: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == payload.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail='Email already registered')
-    user = models.User(email=payload.email, hashed_password=get_password_hash(payload.password), full_name=payload.full_name)
+# bcrypt runs in the password_hasher process pool, outside run_db, so it never
+# holds the event loop, a threadpool slot or a pooled connection.
+
+def _find_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def _create_user(db: Session, payload: schemas.UserCreate, hashed_password: str) -> models.User:
+    user = models.User(email=payload.email, hashed_password=hashed_password, full_name=payload.full_name,
+                       timezone=payload.timezone)
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
+def _update_user(db: Session, user_id: int, payload: schemas.UserUpdate) -> models.User:
+    user = db.get(models.User, user_id)
+    if payload.full_name is not None:
+        user.full_name = payload.full_name
+    med_ids = []
+    if payload.timezone is not None and payload.timezone != user.timezone:
+        user.timezone = payload.timezone
+        # Doses still ahead move to the same wall-clock times in the new zone
+        med_ids = db.execute(select(models.Medication.id).where(models.Medication.user_id == user_id)).scalars().all()
+        if med_ids:
+            scheduler.clear_future_doses(db, med_ids)
+        versions.bump(db, [user_id])
+    db.commit()
+    if med_ids:
+        for med_id in med_ids:
+            due_index.reload_medication(db, med_id)
+        scheduler.generate_schedules(db, user_id=user_id)
+    db.refresh(user)
+    return user
+
+def _set_password_hash(db: Session, user_id: int, hashed_password: str) -> None:
+    user = db.get(models.User, user_id)
+    if user is not None:
+        user.hashed_password = hashed_password
+        db.commit()
+
+async def _rehash_legacy_password(user_id: int, password: str) -> None:
+    try:
+        hashed_password = await password_hasher.hash_password(password)
+    except HTTPException:
+        return  # pool saturated; the next login will try again
+    async with session_scope() as db:
+        await run_db(db, _set_password_hash, user_id, hashed_password)
+
+@router.post('/register', response_model=schemas.UserOut)
+async def register(payload: schemas.UserCreate, db: DbSession = Depends(get_db)):
+    existing = await run_db(db, _find_by_email, payload.email)
+    if existing:
+        raise HTTPException(status_code=400, detail='Email already registered')
+    hashed_password = await password_hasher.hash_password(payload.password)
+    return await run_db(db, _create_user, payload, hashed_password)
+
 @router.post('/login', response_model=schemas.Token)
-def login(form_data: schemas.UserCreate, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.email).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(status_code=401, detail='Invalid credentials')
-    token = create_access_token({"sub": str(user.id)})
-    return {"access_token": token, "token_type": "bearer"}
+async def login(form_data: schemas.UserCreate, background_tasks: BackgroundTasks, db: DbSession = Depends(get_db)):
+    start = time.perf_counter()
+    try:
+        user = await run_db(db, _find_by_email, form_data.email)
+        if not user or not await password_hasher.check_password(form_data.password, user.hashed_password):
+            raise HTTPException(status_code=401, detail='Invalid credentials')
+        if not user.is_active:
+            raise HTTPException(status_code=403, detail='Inactive user')
+        if password_needs_rehash(user.hashed_password):
+            background_tasks.add_task(_rehash_legacy_password, user.id, form_data.password)
+        token = create_access_token({"sub": str(user.id)})
+        return {"access_token": token, "token_type": "bearer"}
+    finally:
+        password_hasher.observe_login(time.perf_counter() - start)
 
 @router.get('/me', response_model=schemas.UserOut)
-def me(current=Depends(get_current_user)):
+async def me(current=Depends(get_current_user)):
     return current
+
+@router.patch('/me', response_model=schemas.UserOut)
+async def update_me(payload: schemas.UserUpdate, db: DbSession = Depends(get_db), current=Depends(get_current_user)):
+    """Change the display name and/or timezone; a new timezone reschedules the doses still ahead."""
+    return await run_db(db, _update_user, current.id, payload)
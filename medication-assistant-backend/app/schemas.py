@@ -76,24 +76,48 @@
 #     missed: int
 #     adherence_rate: float
 
-from pydantic import BaseModel, EmailStr, field_validator, constr
-from typing import List, Optional
+import json
+from pydantic import BaseModel, EmailStr, Field, field_validator, constr
+from typing import List, Literal, Optional
 from datetime import datetime, date
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # =========================
 # Auth Schemas
 # =========================
+def _check_timezone(v: Optional[str]) -> Optional[str]:
+    if v is None:
+        return v
+    try:
+        ZoneInfo(v)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError("timezone must be an IANA name such as 'Europe/Berlin'")
+    return v
+
+
 class UserCreate(BaseModel):
     email: EmailStr
     # Enforce sensible bounds; bcrypt_sha256 supports long passwords, but we still guard extremes
     password: constr(min_length=8, max_length=128)
     full_name: Optional[str] = None
+    # Dose times are wall-clock times in this zone
+    timezone: str = "UTC"
+
+    _validate_timezone = field_validator("timezone")(_check_timezone)
+
+
+class UserUpdate(BaseModel):
+    full_name: Optional[str] = None
+    timezone: Optional[str] = None
+
+    _validate_timezone = field_validator("timezone")(_check_timezone)
 
 
 class UserOut(BaseModel):
     id: int
     email: EmailStr
     full_name: Optional[str] = None
+    timezone: str = "UTC"
 
     class Config:
         from_attributes = True
@@ -135,6 +159,20 @@ class MedicationBase(BaseModel):
                 raise ValueError("time must be a valid 24-hour time (00:00 to 23:59)")
         return v
 
+    @field_validator("days_of_week")
+    @classmethod
+    def validate_days(cls, v: str) -> str:
+        """
+        Validates 'all' or comma-separated weekday numbers 0-6.
+        Example: 'all', '0,2,4'
+        """
+        if v == "all":
+            return v
+        for d in v.split(","):
+            if not (d.strip().isdigit() and 0 <= int(d) <= 6):
+                raise ValueError("days_of_week must be 'all' or comma-separated 0-6")
+        return v
+
 
 class MedicationCreate(MedicationBase):
     pass
@@ -147,6 +185,12 @@ class MedicationUpdate(MedicationBase):
 class MedicationOut(MedicationBase):
     id: int
 
+    @field_validator("times_of_day", mode="before")
+    @classmethod
+    def decode_times(cls, v):
+        # Medication.times_of_day is stored as a JSON string
+        return json.loads(v) if isinstance(v, str) else v
+
     class Config:
         from_attributes = True
 
@@ -165,6 +209,28 @@ class DoseLogOut(BaseModel):
         from_attributes = True
 
 
+class DoseStatusUpdate(BaseModel):
+    dose_id: int
+    status: Literal["taken", "skipped"]
+    # When the client recorded the action (offline sync); defaults to server time for 'taken'
+    taken_at: Optional[datetime] = None
+
+
+class DoseBatchRequest(BaseModel):
+    items: List[DoseStatusUpdate] = Field(min_length=1, max_length=500)
+
+
+class DoseBatchResult(BaseModel):
+    dose_id: int
+    ok: bool
+    status: Optional[str] = None
+    error: Optional[str] = None
+
+
+class DoseBatchResponse(BaseModel):
+    results: List[DoseBatchResult]
+
+
 # =========================
 # Chat Schemas
 # =========================
@@ -189,4 +255,81 @@ class AdherenceStats(BaseModel):
     scheduled: int
     taken: int
     missed: int
-    adherence_rate: float
\ No newline at end of file
+    adherence_rate: float
+
+
+class AdherenceTotals(BaseModel):
+    doses: int
+    pending: int  # still 'scheduled'; excluded from every rate
+    taken: int
+    missed: int
+    skipped: int
+    adherence_rate: float
+
+
+class MedicationAdherence(BaseModel):
+    medication_id: int
+    name: str
+    due: int
+    taken: int
+    adherence_rate: float
+    current_streak: int  # consecutive taken doses up to the latest resolved one
+    longest_streak: int
+
+
+class LatenessBucket(BaseModel):
+    minutes: str  # e.g. '0..15', '<-60', '>=240'
+    count: int
+
+
+class LatenessStats(BaseModel):
+    count: int
+    mean_minutes: Optional[float] = None
+    percentiles: dict[str, float]  # p10, p25, p50, p75, p90
+    on_time_rate: float  # taken within 30 minutes either side of the slot
+    histogram: List[LatenessBucket]
+
+
+class AdherenceSlot(BaseModel):
+    slot: int  # weekday (0 = Monday) or hour of day
+    due: int
+    taken: int
+    adherence_rate: float
+
+
+class AdherenceTrendPoint(BaseModel):
+    start: date
+    due: int
+    taken: int
+    missed: int
+    skipped: int
+    adherence_rate: float
+
+
+class AdherenceAnalytics(BaseModel):
+    period_days: int
+    interval: Literal["day", "week", "month"]
+    totals: AdherenceTotals
+    medications: List[MedicationAdherence]
+    lateness: LatenessStats
+    by_weekday: List[AdherenceSlot]
+    by_hour: List[AdherenceSlot]
+    trend: List[AdherenceTrendPoint]
+    trend_slope: Optional[float] = None  # percentage points per interval
+
+
+# =========================
+# Bulk import
+# =========================
+class BulkRowError(BaseModel):
+    row: int  # 1-based data row (CSV header and blank lines not counted)
+    errors: List[str]
+
+
+class BulkImportResult(BaseModel):
+    received: int
+    imported: int
+    failed: int
+    dry_run: bool = False
+    errors: List[BulkRowError]
+    errors_truncated: bool = False  # more rows failed than are listed
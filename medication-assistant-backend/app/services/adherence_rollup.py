@@ -0,0 +1,152 @@
+"""
+Incremental maintenance of DoseDailyRollup.
+
+Writers collect status transitions into a Deltas map with `track`, then flush them
+with `apply` inside their own transaction. `scheduled` counts every dose slot, the
+other counters count doses currently in that status.
+
+Slots are materialised days ahead (services.scheduler), so readers bound their
+window at the end of today: future days only hold 'scheduled' counts.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..database import dialect_insert
+from .. import models
+from . import versions
+from .archive import dose_source
+
+COUNTERS = ('scheduled', 'taken', 'missed', 'skipped')
+
+# (user_id, medication_id, day) -> counter deltas
+Deltas = dict[tuple[int, int, date], Counter]
+
+
+def new_deltas() -> Deltas:
+    return defaultdict(Counter)
+
+
+def track(deltas: Deltas, user_id: int, medication_id: int, scheduled_at: datetime,
+          old_status: Optional[str], new_status: Optional[str]) -> None:
+    """Record one dose moving from old_status (None for a new dose) to new_status (None for a deleted one)."""
+    if old_status == new_status:
+        return
+    c = deltas[(user_id, medication_id, scheduled_at.date())]
+    if old_status is None:
+        c['scheduled'] += 1
+    elif old_status in COUNTERS[1:]:
+        c[old_status] -= 1
+    if new_status is None:
+        c['scheduled'] -= 1
+    elif new_status in COUNTERS[1:]:
+        c[new_status] += 1
+
+
+def apply(db: Session, deltas: Deltas) -> None:
+    """Upsert the collected deltas onto dose_daily_rollups (no commit)."""
+    rows = [
+        {'user_id': user_id, 'medication_id': med_id, 'day': day, **{k: c.get(k, 0) for k in COUNTERS}}
+        for (user_id, med_id, day), c in deltas.items()
+        if any(c.values())
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(db, models.DoseDailyRollup)
+    if stmt is not None:
+        table = models.DoseDailyRollup.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['medication_id', 'day'],
+            set_={k: table.c[k] + stmt.excluded[k] for k in COUNTERS},
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        rollup = db.get(models.DoseDailyRollup, (row['medication_id'], row['day']))
+        if rollup is None:
+            db.add(models.DoseDailyRollup(**row))
+        else:
+            for k in COUNTERS:
+                setattr(rollup, k, getattr(rollup, k) + row[k])
+
+
+def record_missed(db: Session, rows) -> dict[int, int]:
+    """Apply scheduled->missed for (dose_id, medication_id, scheduled_at) rows from an UPDATE ... RETURNING.
+
+    Returns the medication_id -> user_id owners of the rows.
+    """
+    if not rows:
+        return {}
+    owners = dict(db.execute(
+        select(models.Medication.id, models.Medication.user_id).where(
+            models.Medication.id.in_({med_id for _, med_id, _ in rows})
+        )
+    ).all())
+    deltas = new_deltas()
+    for _, med_id, scheduled_at in rows:
+        track(deltas, owners[med_id], med_id, scheduled_at, 'scheduled', 'missed')
+    apply(db, deltas)
+    versions.bump(db, owners.values())
+    return owners
+
+
+def _aggregate_columns(status):
+    return (
+        func.count().label('scheduled'),
+        func.count().filter(status == 'taken').label('taken'),
+        func.count().filter(status == 'missed').label('missed'),
+        func.count().filter(status == 'skipped').label('skipped'),
+    )
+
+
+def backfill(db: Session) -> bool:
+    """Build the rollup from dose history in one INSERT ... SELECT when the table is empty.
+
+    Not safe to run from several processes at once; app.migrations runs it per deploy.
+    """
+    if db.execute(select(models.DoseDailyRollup.medication_id).limit(1)).first() is not None:
+        return False
+    doses = dose_source(None)
+    day = func.date(doses.c.scheduled_at)
+    source = (
+        select(doses.c.medication_id, day, models.Medication.user_id, *_aggregate_columns(doses.c.status))
+        .join(models.Medication, models.Medication.id == doses.c.medication_id)
+        .group_by(doses.c.medication_id, day, models.Medication.user_id)
+    )
+    db.execute(
+        models.DoseDailyRollup.__table__.insert().from_select(
+            ['medication_id', 'day', 'user_id', *COUNTERS], source
+        )
+    )
+    db.commit()
+    return True
+
+
+def summarize(db: Session, user_id: int, since: date, until: date) -> Optional[dict]:
+    """Sum a user's rollup rows for days in [since, until), or None when no rows exist."""
+    r = db.query(
+        func.count(),
+        *(func.coalesce(func.sum(getattr(models.DoseDailyRollup, k)), 0) for k in COUNTERS),
+    ).filter(
+        models.DoseDailyRollup.user_id == user_id,
+        models.DoseDailyRollup.day >= since,
+        models.DoseDailyRollup.day < until,
+    ).one()
+    if not r[0]:
+        return None
+    return dict(zip(COUNTERS, r[1:]))
+
+
+def aggregate(db: Session, user_id: int, since: datetime, until: datetime) -> dict:
+    """Single conditional-aggregate query over doses in [since, until); used when the rollup has no rows."""
+    doses = dose_source(since)
+    r = db.execute(
+        select(*_aggregate_columns(doses.c.status))
+        .select_from(doses)
+        .join(models.Medication, models.Medication.id == doses.c.medication_id)
+        .where(models.Medication.user_id == user_id, doses.c.scheduled_at >= since, doses.c.scheduled_at < until)
+    ).one()
+    return dict(zip(COUNTERS, r))
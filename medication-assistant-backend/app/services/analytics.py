@@ -0,0 +1,219 @@
+"""
+Adherence analytics over a user's dose history, computed with NumPy.
+
+`fetch` pulls the period in one query as plain integers (medication id, epoch
+seconds of scheduled_at and taken_at, a status code), reading the archive too
+when the period reaches past retention. The period ends with today (UTC days, like
+scheduled_at); slots the scheduler has materialised beyond it are left out. `compute` turns them into int64 column
+arrays and derives every figure with array operations: no per-dose Python.
+
+Rates count resolved doses only (taken, missed or skipped); doses still
+'scheduled' are reported as pending. A streak is a run of consecutive taken
+doses of one medication. Weekday, hour and trend buckets are in the user's
+timezone: scheduled_at is shifted by the UTC offset in force at each dose.
+
+NumPy is imported on first use so workers that never serve analytics don't pay for it.
+"""
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from itertools import chain
+
+from sqlalchemy import BigInteger, case, cast, func, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from .. import models
+from . import schedule, versions
+from .archive import dose_source
+
+STATUS_CODES = ('scheduled', 'taken', 'missed', 'skipped')
+OTHER = len(STATUS_CODES)
+SCHEDULED, TAKEN, MISSED, SKIPPED = range(OTHER)
+NO_TIME = -1  # taken_at is NULL
+
+INTERVALS = ('day', 'week', 'month')
+PERCENTILES = (10, 25, 50, 75, 90)
+# Lateness histogram edges in minutes (taken_at - scheduled_at)
+LATENESS_EDGES = (-60, -15, 0, 15, 30, 60, 120, 240)
+ON_TIME_MINUTES = 30
+
+cache = versions.VersionedCache(settings.analytics_cache_max_entries)
+
+
+def _epoch(db: Session, column):
+    if db.get_bind().dialect.name == 'sqlite':
+        # julianday is about twice as fast as strftime('%s') and keeps sub-second input
+        return cast(func.round((func.julianday(column) - 2440587.5) * 86400), BigInteger)
+    return cast(func.extract('epoch', column), BigInteger)
+
+
+def fetch(db: Session, user_id: int, since: datetime) -> tuple[int, list, dict[int, str], str]:
+    """(row count, flat [med, scheduled, taken, status, ...] rows, {medication_id: name}, timezone)."""
+    doses = dose_source(since)
+    status = case(*((doses.c.status == s, code) for code, s in enumerate(STATUS_CODES)), else_=OTHER)
+    # Executed on the connection: plain integer rows without the ORM result layer (about 2x faster)
+    rows = db.connection().execute(
+        select(doses.c.medication_id, _epoch(db, doses.c.scheduled_at),
+               func.coalesce(_epoch(db, doses.c.taken_at), NO_TIME), status)
+        .join(models.Medication, models.Medication.id == doses.c.medication_id)
+        .where(models.Medication.user_id == user_id, doses.c.scheduled_at >= since,
+               doses.c.scheduled_at < since_for(-1))
+    ).all()
+    names = dict(db.execute(
+        select(models.Medication.id, models.Medication.name).where(models.Medication.user_id == user_id)
+    ).all())
+    tz_name = db.execute(select(models.User.timezone).where(models.User.id == user_id)).scalar()
+    return len(rows), rows, names, tz_name
+
+
+def _rate(taken, due):
+    import numpy as np
+    return np.round(np.divide(taken * 100.0, due, out=np.zeros(len(due)), where=due > 0), 2)
+
+
+def _streaks(med, sched, taken) -> tuple:
+    """Per medication (sorted ids): longest and current run of consecutive taken doses."""
+    import numpy as np
+
+    order = np.lexsort((sched, med))
+    med, taken = med[order], taken[order]
+    med_ids = np.unique(med)
+    if not len(med):
+        return med_ids, np.zeros(0, np.int64), np.zeros(0, np.int64)
+    starts = np.flatnonzero(np.r_[True, (med[1:] != med[:-1]) | (taken[1:] != taken[:-1])])
+    lengths = np.diff(np.r_[starts, len(med)])
+    run_med, run_taken = med[starts], taken[starts]
+
+    longest = np.zeros(len(med_ids), np.int64)
+    np.maximum.at(longest, np.searchsorted(med_ids, run_med[run_taken]), lengths[run_taken])
+    last = np.r_[run_med[1:] != run_med[:-1], True]  # final run of each medication
+    current = np.where(run_taken[last], lengths[last], 0)
+    return med_ids, longest, current
+
+
+def _utc_offsets(sched, tz: tzinfo):
+    """Seconds to add to each epoch in `sched` for wall-clock time in `tz`."""
+    import numpy as np
+
+    if tz is timezone.utc or not len(sched):
+        return 0
+
+    def offset(at: int) -> int:
+        return int(datetime.fromtimestamp(at, tz).utcoffset().total_seconds())
+
+    # Offsets change a few times a year, on a quarter hour: find each change day by
+    # day, then pin it down by quarter hour; a lookup per dose is then a search
+    first = int(sched.min()) // 86400 * 86400
+    starts, values = [first], [offset(first)]
+    for day in range(first + 86400, int(sched.max()) + 86400, 86400):
+        if offset(day) != values[-1]:
+            at = next(t for t in range(day - 86400 + 900, day + 1, 900) if offset(t) != values[-1])
+            starts.append(at)
+            values.append(offset(at))
+    return np.asarray(values, np.int64)[np.searchsorted(starts, sched, side='right') - 1]
+
+
+def _slots(keys, resolved, taken, size: int) -> list[dict]:
+    import numpy as np
+
+    due = np.bincount(keys[resolved], minlength=size)
+    took = np.bincount(keys[taken], minlength=size)
+    return [{'slot': i, 'due': d, 'taken': t, 'adherence_rate': r}
+            for i, (d, t, r) in enumerate(zip(due.tolist(), took.tolist(), _rate(took, due).tolist()))]
+
+
+def _trend(sched, status, resolved, interval: str) -> tuple[list[dict], float | None]:
+    import numpy as np
+
+    days = sched // 86400
+    if interval == 'day':
+        keys = days
+    elif interval == 'week':
+        keys = days - (days + 3) % 7  # back to Monday (1970-01-01 was a Thursday)
+    else:
+        keys = sched.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    starts, bucket = np.unique(keys[resolved], return_inverse=True)
+    counts = {code: np.bincount(bucket, weights=status[resolved] == code, minlength=len(starts)).astype(np.int64)
+              for code in (TAKEN, MISSED, SKIPPED)}
+    due = counts[TAKEN] + counts[MISSED] + counts[SKIPPED]
+    rates = _rate(counts[TAKEN], due)
+    unit = 'M' if interval == 'month' else 'D'
+    labels = starts.astype(f'datetime64[{unit}]').astype('datetime64[D]').tolist()
+    trend = [
+        {'start': start, 'due': d, 'taken': t, 'missed': m, 'skipped': s, 'adherence_rate': r}
+        for start, d, t, m, s, r in zip(labels, due.tolist(), counts[TAKEN].tolist(), counts[MISSED].tolist(),
+                                        counts[SKIPPED].tolist(), rates.tolist())
+    ]
+    # Least-squares slope of the rate, in percentage points per interval
+    slope = round(float(np.polyfit(np.arange(len(rates)), rates, 1)[0]), 3) if len(rates) > 1 else None
+    return trend, slope
+
+
+def _lateness(sched, taken_at, taken) -> dict:
+    import numpy as np
+
+    timed = taken & (taken_at != NO_TIME)
+    late = (taken_at[timed] - sched[timed]) / 60.0
+    bins = np.bincount(np.searchsorted(LATENESS_EDGES, late, side='right'), minlength=len(LATENESS_EDGES) + 1)
+    labels = ([f'<{LATENESS_EDGES[0]}']
+              + [f'{lo}..{hi}' for lo, hi in zip(LATENESS_EDGES, LATENESS_EDGES[1:])]
+              + [f'>={LATENESS_EDGES[-1]}'])
+    if not len(late):
+        return {'count': 0, 'mean_minutes': None, 'percentiles': {}, 'on_time_rate': 0.0,
+                'histogram': [{'minutes': label, 'count': 0} for label in labels]}
+    pcts = np.percentile(late, PERCENTILES)
+    return {
+        'count': int(len(late)),
+        'mean_minutes': round(float(late.mean()), 2),
+        'percentiles': {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, pcts)},
+        'on_time_rate': round(float((np.abs(late) <= ON_TIME_MINUTES).mean() * 100.0), 2),
+        'histogram': [{'minutes': label, 'count': n} for label, n in zip(labels, bins.tolist())],
+    }
+
+
+def compute(fetched: tuple[int, list, dict[int, str], str], period_days: int, interval: str) -> dict:
+    import numpy as np
+
+    n, rows, names, tz_name = fetched
+    data = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=4 * n).reshape(n, 4)
+    med, sched, taken_at, status = data.T
+    resolved = (status == TAKEN) | (status == MISSED) | (status == SKIPPED)
+    taken = status == TAKEN
+
+    counts = np.bincount(status, minlength=OTHER + 1)
+    due = int(counts[TAKEN] + counts[MISSED] + counts[SKIPPED])
+    totals = {
+        'doses': n, 'pending': int(counts[SCHEDULED]), 'taken': int(counts[TAKEN]),
+        'missed': int(counts[MISSED]), 'skipped': int(counts[SKIPPED]),
+        'adherence_rate': round(float(counts[TAKEN]) * 100.0 / due, 2) if due else 0.0,
+    }
+
+    med_ids, longest, current = _streaks(med[resolved], sched[resolved], taken[resolved])
+    index = np.searchsorted(med_ids, med[resolved])
+    med_due = np.bincount(index, minlength=len(med_ids))
+    med_taken = np.bincount(index, weights=taken[resolved], minlength=len(med_ids)).astype(np.int64)
+    medications = [
+        {'medication_id': m, 'name': names.get(m, ''), 'due': d, 'taken': t, 'adherence_rate': r,
+         'current_streak': c, 'longest_streak': l}
+        for m, d, t, r, c, l in zip(med_ids.tolist(), med_due.tolist(), med_taken.tolist(),
+                                    _rate(med_taken, med_due).tolist(), current.tolist(), longest.tolist())
+    ]
+
+    local = sched + _utc_offsets(sched, schedule.zone(tz_name))
+    days = local // 86400
+    trend, slope = _trend(local, status, resolved, interval)
+    return {
+        'period_days': period_days,
+        'interval': interval,
+        'totals': totals,
+        'medications': medications,
+        'lateness': _lateness(sched, taken_at, taken),
+        'by_weekday': _slots((days + 3) % 7, resolved, taken, 7),
+        'by_hour': _slots((local % 86400) // 3600, resolved, taken, 24),
+        'trend': trend,
+        'trend_slope': slope,
+    }
+
+
+def since_for(period_days: int) -> datetime:
+    """Midnight (UTC) `period_days` before today; since_for(-1) is the end of today."""
+    return datetime.combine(datetime.utcnow().date(), time.min) - timedelta(days=period_days)
@@ -0,0 +1,57 @@
+"""
+Retention tiers for dose history.
+
+`dose_logs` is the hot table: only the last DOSE_RETENTION_DAYS, which is all the
+scheduler, reminders and dose actions ever touch. `archive_old_doses` moves older
+rows to `dose_logs_archive` in bounded batches (INSERT ... SELECT then DELETE by
+id, one transaction per batch). Readers that may look further back build their
+query on `dose_source(since)`, which only adds the archive when the window
+actually crosses the retention boundary.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, union_all
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from .. import models
+
+COLUMNS = ('id', 'medication_id', 'scheduled_at', 'taken_at', 'status', 'notes')
+
+
+def retention_cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(days=settings.dose_retention_days)
+
+
+def dose_source(since: Optional[datetime]):
+    """Selectable exposing COLUMNS over dose_logs, plus the archive when `since` predates retention."""
+    hot = models.DoseLog.__table__
+    if since is not None and since >= retention_cutoff():
+        return hot
+    cold = models.DoseLogArchive.__table__
+    return union_all(
+        select(*(hot.c[c] for c in COLUMNS)),
+        select(*(cold.c[c] for c in COLUMNS)),
+    ).subquery('dose_history')
+
+
+def archive_old_doses(db: Session) -> int:
+    """Move dose_logs rows older than the retention window into the archive; returns rows moved."""
+    cutoff = retention_cutoff()
+    hot = models.DoseLog.__table__
+    moved = 0
+    while True:
+        ids = db.execute(
+            select(hot.c.id).where(hot.c.scheduled_at < cutoff).order_by(hot.c.scheduled_at).limit(settings.archive_batch_size)
+        ).scalars().all()
+        if not ids:
+            return moved
+        db.execute(
+            models.DoseLogArchive.__table__.insert().from_select(
+                list(COLUMNS), select(*(hot.c[c] for c in COLUMNS)).where(hot.c.id.in_(ids))
+            )
+        )
+        db.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.commit()
+        moved += len(ids)
@@ -1,26 +1,79 @@
-from openai import AzureOpenAI
+import time
+from typing import TYPE_CHECKING, AsyncIterator
+
 from ..config import settings
+from . import metrics
+
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
 
 _client = None
 
-def get_client() -> AzureOpenAI:
+def get_client() -> 'AsyncAzureOpenAI':
     global _client
     if _client is None:
-        _client = AzureOpenAI(
+        # Imported on first use: the SDK and httpx add ~0.5 s to every worker's startup
+        import httpx
+        from openai import AsyncAzureOpenAI
+        # One pooled HTTP client per process; keeps TLS connections to Azure warm
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.azure_openai_max_connections,
+                max_keepalive_connections=settings.azure_openai_max_keepalive,
+            ),
+            timeout=httpx.Timeout(settings.azure_openai_timeout, connect=settings.azure_openai_connect_timeout),
+        )
+        _client = AsyncAzureOpenAI(
             api_key=settings.azure_openai_api_key,
             api_version=settings.azure_openai_api_version,
             azure_endpoint=settings.azure_openai_endpoint,
+            max_retries=0,  # retries are made by services.llm_gateway
+            http_client=http_client,
         )
     return _client
 
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
 async def chat(messages: list[dict]) -> str:
+    """One upstream call; errors propagate (services.llm_gateway decides on retries)."""
+    client = get_client()
+    started = time.perf_counter()
+    try:
+        resp = await client.chat.completions.create(
+            model=settings.azure_openai_deployment,
+            messages=messages,
+            temperature=0.2,
+        )
+    except Exception:
+        metrics.observe_openai('chat', time.perf_counter() - started, ok=False)
+        raise
+    metrics.observe_openai('chat', time.perf_counter() - started, ok=True, usage=resp.usage)
+    return resp.choices[0].message.content or ""
+
+async def chat_stream(messages: list[dict]) -> AsyncIterator[str]:
+    """Yield reply text fragments as Azure OpenAI produces them."""
     client = get_client()
+    started = time.perf_counter()
+    ok, usage = False, None
     try:
-        resp = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=settings.azure_openai_deployment,
             messages=messages,
             temperature=0.2,
+            stream=True,
+            stream_options={'include_usage': True},
         )
-        return resp.choices[0].message.content or ""
-    except Exception as e:
-        return f"AI error: {e}"
+        async for chunk in stream:
+            # Azure sends a leading chunk with prompt filter results and no choices;
+            # the final chunk carries only usage
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        ok = True
+    finally:
+        metrics.observe_openai('chat_stream', time.perf_counter() - started, ok=ok, usage=usage)
@@ -0,0 +1,118 @@
+"""
+Response cache in front of llm_gateway.chat.
+
+Keys hash the full message list (system prompt included) after normalizing case
+and whitespace, so "What if I miss a dose?" and "what if i miss a dose" share an
+entry. Conversations carrying user-specific context must pass `user_id`, which
+scopes the key to that user. Misses go through the gateway keyed the same way,
+so identical questions arriving together make one upstream call; errors raise
+and are never cached.
+"""
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..config import settings
+from .llm_gateway import chat as ai_chat
+
+_WS = re.compile(r'\s+')
+
+
+def normalize(content: str) -> str:
+    return _WS.sub(' ', content).strip().lower().rstrip('?!. ')
+
+
+def cache_key(messages: list[dict], user_id: Optional[int] = None) -> str:
+    normalized = [[m['role'], normalize(m['content'])] for m in messages]
+    digest = hashlib.sha256(json.dumps(normalized, separators=(',', ':')).encode()).hexdigest()
+    scope = f'u{user_id}' if user_id is not None else 'shared'
+    return f'chat:{scope}:{digest}'
+
+
+class MemoryBackend:
+    """Per-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared cache across workers; Redis handles expiry and eviction (maxmemory-policy allkeys-lru)."""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("CHAT_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self.ttl_seconds = ttl_seconds
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        await self._redis.set(key, value, ex=self.ttl_seconds)
+
+
+def _make_backend():
+    if settings.chat_cache_backend == 'redis':
+        return RedisBackend(settings.chat_cache_redis_url, settings.chat_cache_ttl_seconds)
+    if settings.chat_cache_backend == 'memory':
+        return MemoryBackend(settings.chat_cache_max_entries, settings.chat_cache_ttl_seconds)
+    return None
+
+
+backend = _make_backend()
+stats = {'hits': 0, 'misses': 0}
+
+
+async def cached_chat(messages: list[dict], user_id: Optional[int] = None, caller_id: Optional[int] = None) -> str:
+    """`user_id` scopes the cache entry; `caller_id` (default `user_id`) is who the
+    gateway's per-user concurrency limit counts the call against."""
+    key = cache_key(messages, user_id)
+    caller_id = caller_id if caller_id is not None else user_id
+    if backend is None:
+        return await ai_chat(messages, caller_id, key)
+    reply = await backend.get(key)
+    if reply is not None:
+        stats['hits'] += 1
+        return reply
+    stats['misses'] += 1
+    reply = await ai_chat(messages, caller_id, key)
+    await backend.set(key, reply)
+    return reply
+
+
+def cache_stats() -> dict:
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'backend': settings.chat_cache_backend,
+        **stats,
+        'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+        'entries': len(backend) if isinstance(backend, MemoryBackend) else None,
+    }
@@ -0,0 +1,231 @@
+"""
+Prompt assembly for /chat: a per-user medication summary plus the conversation,
+trimmed to CHAT_CONTEXT_TOKEN_BUDGET. The summary is only added when the latest
+question is about the user (`needs_summary`); general questions stay free of it so
+the chat cache can share their replies across users.
+
+The summary (active medications, today's doses, 30-day adherence) is cached per
+process and stamped with the user's data version (services.versions), which every
+medication and dose write already bumps, and their local date; a chat turn
+therefore costs two primary-key reads until the user's data changes or their day
+rolls over, and the next turn rebuilds it.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated at
+four characters per token. When the history does not fit, the oldest turns are
+dropped and replaced by a short recap of the questions they asked.
+"""
+import json
+import re
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from .. import models
+from . import adherence_rollup, schedule, versions
+
+# Per-message framing (role, separators) and the primer for the assistant reply,
+# as counted by OpenAI's chat format
+MESSAGE_OVERHEAD = 4
+REPLY_PRIMING = 3
+RECAP_QUESTION_CHARS = 120
+# First-person words that make a question about the user's own records (not "me":
+# "tell me about X" is a general question)
+_FIRST_PERSON = re.compile(r"\b(i|i'm|i've|i'd|my|mine|myself)\b", re.IGNORECASE)
+
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+_encoder = None  # tiktoken Encoding, loaded on first use
+_encoder_loaded = False
+
+
+def _load_encoder():
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(settings.chat_tokenizer_encoding)
+        except Exception:
+            _encoder = None  # not installed, or the encoding file is unavailable
+        _encoder_loaded = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    encoder = _load_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD + count_tokens(message['content'])
+
+
+def _clip(text: str, tokens: int) -> str:
+    """Keep the start of `text` within `tokens`."""
+    encoder = _load_encoder()
+    if encoder is not None:
+        ids = encoder.encode(text)
+        return text if len(ids) <= tokens else encoder.decode(ids[:tokens]) + '…'
+    return text if len(text) <= tokens * 4 else text[:tokens * 4] + '…'
+
+
+# ---- per-user summary ----
+
+summaries = versions.VersionedCache(settings.chat_summary_cache_max_entries)
+
+
+def _days(days_of_week: str) -> str:
+    if not days_of_week or days_of_week == 'all':
+        return 'daily'
+    return ', '.join(DAY_NAMES[int(d)] for d in days_of_week.split(',') if d.strip().isdigit() and int(d) < 7)
+
+
+def _user_today(db: Session, user_id: int) -> tuple[tzinfo, date]:
+    # "Today" and dose times are the user's own; dose_logs hold naive UTC
+    tz = schedule.zone(db.execute(select(models.User.timezone).where(models.User.id == user_id)).scalar())
+    return tz, schedule.local_date(tz, datetime.utcnow())
+
+
+def build_summary(db: Session, user_id: int, tz: tzinfo, today: date) -> str:
+    day_start, day_end = schedule.utc_slot(tz, today, 0), schedule.utc_slot(tz, today + timedelta(days=1), 0)
+    meds = db.execute(
+        select(models.Medication.name, models.Medication.dosage, models.Medication.times_of_day,
+               models.Medication.days_of_week, models.Medication.start_date, models.Medication.end_date)
+        .where(
+            models.Medication.user_id == user_id,
+            or_(models.Medication.end_date.is_(None), models.Medication.end_date >= today),
+        )
+        .order_by(models.Medication.name)
+    ).all()
+    doses = db.execute(
+        select(models.DoseLog.status, models.DoseLog.scheduled_at, models.Medication.name)
+        .join(models.Medication, models.Medication.id == models.DoseLog.medication_id)
+        .where(
+            models.Medication.user_id == user_id,
+            models.DoseLog.scheduled_at >= day_start,
+            models.DoseLog.scheduled_at < day_end,
+        )
+        .order_by(models.DoseLog.scheduled_at)
+    ).all()
+    # The rollup is by UTC day, as in /adherence/stats
+    until = datetime.utcnow().date() + timedelta(days=1)
+    since = until - timedelta(days=31)
+    counts = adherence_rollup.summarize(db, user_id, since, until)
+    if counts is None:
+        counts = adherence_rollup.aggregate(db, user_id, datetime.combine(since, time.min), datetime.combine(until, time.min))
+
+    limit = settings.chat_summary_max_medications
+    lines = [f'Current medications ({len(meds)}):' if meds else 'No current medications on record.']
+    for m in meds[:limit]:
+        times = ', '.join(json.loads(m.times_of_day or '[]')) or 'no set times'
+        line = f'- {m.name} {m.dosage}: {times}, {_days(m.days_of_week)}'
+        if m.start_date and m.start_date > today:
+            line += f', starting {m.start_date.isoformat()}'
+        if m.end_date:
+            line += f', until {m.end_date.isoformat()}'
+        lines.append(line)
+    if len(meds) > limit:
+        lines.append(f'- and {len(meds) - limit} more')
+
+    if doses:
+        # Slot times and statuses only: nothing here may depend on the clock, since the
+        # text is cached until the user's data version changes
+        shown = ', '.join(f'{schedule.to_local(tz, d.scheduled_at):%H:%M} {d.name} {d.status}' for d in doses[:limit])
+        more = f' and {len(doses) - limit} more' if len(doses) > limit else ''
+        lines.append(f"Today's doses: {shown}{more}.")
+
+    if counts['scheduled']:
+        rate = counts['taken'] / counts['scheduled'] * 100.0
+        lines.append(f"Adherence, last 30 days: {rate:.0f}% ({counts['taken']} of {counts['scheduled']} "
+                     f"doses taken, {counts['missed']} missed).")
+    return _clip('\n'.join(lines), settings.chat_summary_max_tokens)
+
+
+def user_summary(db: Session, user_id: int) -> str:
+    """Cached summary for the user, rebuilt when their data version or local date has moved."""
+    tz, today = _user_today(db, user_id)
+    stamp = (versions.current(db, user_id), today)
+    text = summaries.get(user_id, stamp)
+    if text is None:
+        text = build_summary(db, user_id, tz, today)
+        summaries.set(user_id, stamp, text)
+    return text
+
+
+def summary_stats() -> dict:
+    return summaries.stats()
+
+
+def needs_summary(messages: list[dict]) -> bool:
+    """
+    Whether the latest user turn is about the user (first person). General questions
+    go without the summary so their replies stay shareable in the cross-user cache.
+    """
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            return bool(_FIRST_PERSON.search(message.get('content') or ''))
+    return False
+
+
+def summary_message(text: str) -> dict:
+    return {
+        'role': 'system',
+        'content': "The user's own records (use them to answer questions about their schedule):\n" + text,
+    }
+
+
+# ---- history trimming ----
+
+def _recap(dropped: list[dict], budget: int) -> dict:
+    """Short note standing in for dropped turns: the user's questions, newest kept first."""
+    note = f'{len(dropped)} earlier messages of this conversation were omitted.'
+    questions, used = [], count_tokens(note) + 8
+    for m in reversed(dropped):
+        if m['role'] != 'user':
+            continue
+        q = ' '.join(m['content'].split())
+        q = q if len(q) <= RECAP_QUESTION_CHARS else q[:RECAP_QUESTION_CHARS] + '…'
+        cost = count_tokens(q) + 2
+        if used + cost > budget:
+            break
+        questions.append(q)
+        used += cost
+    if questions:
+        note += ' The user had asked: ' + '; '.join(f'"{q}"' for q in reversed(questions)) + '.'
+    return {'role': 'system', 'content': note}
+
+
+def fit_history(fixed: list[dict], history: list[dict], budget: Optional[int] = None) -> tuple[list[dict], int, int]:
+    """Fit `fixed` + the newest of `history` into `budget` tokens.
+
+    Returns (messages, prompt tokens, dropped message count). The last message is
+    always kept, clipped if it alone exceeds the budget.
+    """
+    budget = budget or settings.chat_context_token_budget
+    fixed_tokens = REPLY_PRIMING + sum(message_tokens(m) for m in fixed)
+    costs = [message_tokens(m) for m in history]
+    if fixed_tokens + sum(costs) <= budget:
+        return fixed + history, fixed_tokens + sum(costs), 0
+
+    room = budget - fixed_tokens - settings.chat_context_recap_tokens - MESSAGE_OVERHEAD
+    keep, used = len(history), 0
+    while keep > 0 and (keep == len(history) or used + costs[keep - 1] <= room):
+        used += costs[keep - 1]
+        keep -= 1
+    kept = history[keep:]
+    if not keep:
+        room += settings.chat_context_recap_tokens + MESSAGE_OVERHEAD  # nothing dropped, no recap
+    if kept and used > room:
+        last = kept[-1]
+        # One token of the room goes to the ellipsis _clip appends
+        kept = [{**last, 'content': _clip(last['content'], max(room - MESSAGE_OVERHEAD - 1, 1))}]
+        used = message_tokens(kept[0])
+
+    if not keep:
+        return fixed + kept, fixed_tokens + used, 0
+    recap = _recap(history[:keep], settings.chat_context_recap_tokens)
+    return fixed + [recap] + kept, fixed_tokens + message_tokens(recap) + used, keep
@@ -0,0 +1,61 @@
+"""
+Lease rows in `scheduler_leases` let several worker processes share the scheduler.
+
+A lease is taken with a single INSERT ... ON CONFLICT DO UPDATE ... WHERE that only
+succeeds when the row is absent, expired, or already ours, so acquisition is
+atomic on both Postgres and SQLite without advisory locks. Expiry uses each
+host's UTC clock, so keep SCHEDULER_LEASE_SECONDS well above expected skew.
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from ..database import dialect_insert
+from .. import models
+
+# Identifies this process as a lease holder
+HOLDER_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def try_acquire(db: Session, name: str, until: datetime, holder: str = HOLDER_ID) -> bool:
+    """Take or renew lease `name` until `until`; False if another live holder has it."""
+    now = datetime.utcnow()
+    lease = models.SchedulerLease.__table__
+    stmt = dialect_insert(db, models.SchedulerLease)
+    if stmt is None:
+        raise RuntimeError(f'scheduler leases are not supported on {db.get_bind().dialect.name}')
+    stmt = stmt.values(name=name, holder=holder, expires_at=until).on_conflict_do_update(
+        index_elements=['name'],
+        set_={'holder': holder, 'expires_at': until},
+        where=or_(lease.c.expires_at < now, lease.c.holder == holder),
+    ).returning(lease.c.holder)
+    acquired = db.execute(stmt).first() is not None
+    db.commit()
+    return acquired
+
+
+def holds(db: Session, name: str, holder: str = HOLDER_ID) -> bool:
+    """Whether `holder` has lease `name` right now (read-only, unlike try_acquire)."""
+    lease = models.SchedulerLease
+    return db.execute(
+        select(lease.name).where(lease.name == name, lease.holder == holder, lease.expires_at >= datetime.utcnow())
+    ).first() is not None
+
+
+def hold_until(db: Session, name: str, until: datetime, holder: str = HOLDER_ID) -> None:
+    """Move our lease's expiry, e.g. to the end of the tick period once its work is done."""
+    db.execute(
+        update(models.SchedulerLease)
+        .where(models.SchedulerLease.name == name, models.SchedulerLease.holder == holder)
+        .values(expires_at=until)
+    )
+    db.commit()
+
+
+def release(db: Session, name: str, holder: str = HOLDER_ID) -> None:
+    hold_until(db, name, datetime.utcnow() - timedelta(seconds=1), holder)
+
@@ -0,0 +1,327 @@
+"""
+In-process timer heap of pending doses.
+
+Each pending dose holds one heap entry `(fire_at, dose_id, medication_id, generation, kind)`:
+a REMINDER entry at its scheduled time, replaced by a MISSED entry at
+scheduled time + MISSED_GRACE_MINUTES once the reminder fires. A single daemon
+thread sleeps until the earliest entry is due and fires everything that is due in
+one query per kind.
+
+The heap is a cache of dose_logs, never the source of truth: firing re-checks
+`status = 'scheduled'` in the same statement, so entries made stale by another
+worker (dose taken, medication deleted) are harmless no-ops. Local changes also
+cancel entries eagerly: `cancel_dose` for a single dose, and `cancel_medication`,
+which bumps the medication's generation so its older entries are dropped. A dose's
+live entry is tracked by generation, so pushing an indexed dose again is a no-op.
+
+The heap only covers the next two tick periods, not the whole materialised
+horizon: every tick that runs here calls `sync`, which moves the window on and
+indexes the pending doses due inside it; pushes beyond the window are skipped
+until a later sync reaches them. Doses that other workers created are therefore
+picked up within one tick, and any of them that fell due since the previous sync
+get their reminder then.
+
+With SCHEDULER_MODE=leader only the holder of the 'tick' lease keeps a heap, synced
+by each tick it leads. A worker that finds the lease gone clears its heap
+(`resign`). Reminders falling due between a leader's death and the next leader's
+first tick are not sent; the missed transitions still are.
+Scheduled times are naive UTC, matching check_missed_doses; reminder texts show
+them in the user's timezone.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database import SessionLocal
+from .. import models
+from . import adherence_rollup, coordination, events, schedule
+from .notifier import send_notification
+
+log = logging.getLogger(__name__)
+
+REMINDER, MISSED = 0, 1
+_EPOCH = datetime(1970, 1, 1)
+# Rows per SELECT when loading pending doses
+LOAD_BATCH_SIZE = 10000
+# The heap covers this many tick periods ahead of each sync
+WINDOW_TICKS = 2
+
+
+def _ts(dt: datetime) -> float:
+    return (dt - _EPOCH).total_seconds()
+
+
+class DueIndex:
+    def __init__(self):
+        self._heap: list[tuple[float, int, int, int, int]] = []
+        self._generations: dict[int, int] = {}
+        # dose_id -> generation of its live entry; entries of any other generation are stale
+        self._live: dict[int, int] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._leading = False
+        self._synced_at = 0.0
+        self._until = 0.0  # end of the indexed window
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def _grace(self) -> float:
+        return settings.missed_grace_minutes * 60.0
+
+    # ---- updates -------------------------------------------------------------
+
+    def _push_locked(self, dose_id: int, medication_id: int, scheduled_at: datetime, now: float, late: float) -> bool:
+        gen = self._generations.get(medication_id, 0)
+        if self._live.get(dose_id) == gen:
+            return False  # already indexed
+        due = _ts(scheduled_at)
+        if due >= self._until:
+            return False  # a later sync loads it
+        if due > now:
+            entry = (due, dose_id, medication_id, gen, REMINDER)
+        elif due + late > now:
+            entry = (now, dose_id, medication_id, gen, REMINDER)
+        elif due + self._grace > now:
+            # Already due (e.g. after a restart): don't re-send the reminder, just track the miss
+            entry = (due + self._grace, dose_id, medication_id, gen, MISSED)
+        else:
+            return False  # left for check_missed_doses
+        heapq.heappush(self._heap, entry)
+        self._live[dose_id] = gen
+        return True
+
+    def push_many(self, doses: Iterable[tuple[int, int, datetime]], late: float = 0.0) -> None:
+        """
+        Index (dose_id, medication_id, scheduled_at) rows of 'scheduled' doses. Doses
+        that fell due less than `late` seconds ago still get their reminder.
+        """
+        if not self._running or not self._leading:
+            return
+        now = time.time()
+        with self._cond:
+            earliest = self._heap[0][0] if self._heap else None
+            for dose_id, medication_id, scheduled_at in doses:
+                self._push_locked(dose_id, medication_id, scheduled_at, now, late)
+            if self._heap and (earliest is None or self._heap[0][0] < earliest):
+                self._cond.notify()
+
+    def cancel_dose(self, dose_id: int, scheduled_at: datetime) -> None:
+        if not self._running:
+            return
+        with self._cond:
+            self._live.pop(dose_id, None)
+
+    def cancel_medication(self, medication_id: int) -> None:
+        if not self._running:
+            return
+        with self._cond:
+            self._generations[medication_id] = self._generations.get(medication_id, 0) + 1
+
+    def reload_medication(self, db: Session, medication_id: int) -> None:
+        """Drop a medication's entries and re-index its pending doses (after create/update)."""
+        if not self._running or not self._leading:
+            return
+        self.cancel_medication(medication_id)
+        rows = db.execute(
+            select(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at).where(
+                models.DoseLog.medication_id == medication_id,
+                models.DoseLog.status == 'scheduled',
+                models.DoseLog.scheduled_at >= datetime.utcnow() - timedelta(seconds=self._grace),
+            )
+        ).all()
+        self.push_many(rows)
+
+    def load(self, db: Session, until: datetime, late: float = 0.0) -> int:
+        """Index every pending dose still within its grace window and due before `until`, in id-ordered batches."""
+        since = datetime.utcnow() - timedelta(seconds=self._grace)
+        query = (
+            select(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+            .where(models.DoseLog.status == 'scheduled', models.DoseLog.scheduled_at >= since,
+                   models.DoseLog.scheduled_at < until)
+            .order_by(models.DoseLog.id)
+            .limit(LOAD_BATCH_SIZE)
+        )
+        last_id = 0
+        loaded = 0
+        while True:
+            rows = db.execute(query.where(models.DoseLog.id > last_id)).all()
+            if not rows:
+                return loaded
+            self.push_many(rows, late)
+            loaded += len(rows)
+            last_id = rows[-1][0]
+
+    # ---- window and leadership --------------------------------------------------
+
+    def sync(self, db: Session) -> int:
+        """
+        Called at start and by every tick that runs here (each tick this worker leads,
+        in leader mode): move the window on and index the doses due inside it.
+        """
+        if not self._running:
+            return 0
+        now = time.time()
+        until = datetime.utcnow() + timedelta(minutes=WINDOW_TICKS * settings.scheduler_interval_minutes)
+        with self._cond:
+            # Doses found now that fell due since the last sync were created elsewhere after it
+            late = min(now - self._synced_at, self._grace) if self._leading else 0.0
+            self._leading = True
+            self._synced_at = now
+            self._until = _ts(until)
+        return self.load(db, until, late)
+
+    def resign(self) -> None:
+        """Another worker holds the lease: its index fires from here on."""
+        with self._cond:
+            if not self._leading:
+                return
+            self._leading = False
+            self._heap.clear()
+            self._live.clear()
+
+    # ---- firing --------------------------------------------------------------
+
+    def _pop_due(self, now: float) -> list[tuple[float, int, int, int, int]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            _, dose_id, medication_id, gen, kind = entry
+            if self._live.get(dose_id) != gen:
+                continue  # cancelled, or superseded by a newer entry
+            stale = gen != self._generations.get(medication_id, 0)
+            if stale or kind == MISSED:
+                del self._live[dose_id]
+            if stale:
+                continue
+            # A fired reminder stays live until its MISSED entry replaces it
+            due.append(entry)
+        return due
+
+    def _drop_live(self, entries) -> None:
+        with self._cond:
+            for _, dose_id, _, gen, _ in entries:
+                if self._live.get(dose_id) == gen:
+                    del self._live[dose_id]
+
+    def _fire(self, entries) -> None:
+        reminders = [e for e in entries if e[4] == REMINDER]
+        missed_ids = [e[1] for e in entries if e[4] == MISSED]
+        db = SessionLocal()
+        try:
+            if settings.scheduler_mode == 'leader' and not coordination.holds(db, 'tick'):
+                # Lost the lease: the new leader's `lead` loads these doses from the database
+                self.resign()
+                return
+            if reminders:
+                self._send_reminders(db, reminders)
+            if missed_ids:
+                self._mark_missed(db, missed_ids)
+        finally:
+            db.close()
+
+    def _send_reminders(self, db: Session, entries) -> None:
+        rows = db.execute(
+            select(models.DoseLog.id, models.DoseLog.scheduled_at, models.Medication.id, models.Medication.name,
+                   models.Medication.dosage, models.User.id, models.User.email, models.User.timezone)
+            .join(models.Medication, models.Medication.id == models.DoseLog.medication_id)
+            .join(models.User, models.User.id == models.Medication.user_id)
+            .where(models.DoseLog.id.in_([e[1] for e in entries]), models.DoseLog.status == 'scheduled')
+        ).all()
+        for dose_id, scheduled_at, med_id, name, dosage, user_id, email, tz_name in rows:
+            local = schedule.to_local(schedule.zone(tz_name), scheduled_at)
+            send_notification(email, f"Time to take {name}", f"{dosage} scheduled at {local:%H:%M}", due_at=scheduled_at)
+            events.publish(user_id, events.DOSE_DUE, dose_id=dose_id, medication_id=med_id,
+                           name=name, dosage=dosage, scheduled_at=scheduled_at.isoformat())
+        still_pending = {r[0]: r[1] for r in rows}
+        now = time.time()
+        with self._cond:
+            for _, dose_id, medication_id, gen, _ in entries:
+                if self._live.get(dose_id) != gen:
+                    continue
+                if dose_id in still_pending:
+                    heapq.heappush(self._heap, (_ts(still_pending[dose_id]) + self._grace, dose_id, medication_id, gen, MISSED))
+                else:
+                    del self._live[dose_id]
+            if self._heap and self._heap[0][0] <= now:
+                self._cond.notify()
+
+    def _mark_missed(self, db: Session, dose_ids: list[int]) -> None:
+        rows = db.execute(
+            update(models.DoseLog)
+            .where(models.DoseLog.id.in_(dose_ids), models.DoseLog.status == 'scheduled')
+            .values(status='missed')
+            .returning(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        owners = adherence_rollup.record_missed(db, rows)
+        db.commit()
+        events.publish_missed(owners, rows)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(timeout=(self._heap[0][0] - now) if self._heap else None)
+                if not self._running:
+                    return
+                entries = self._pop_due(time.time())
+            if entries:
+                try:
+                    self._fire(entries)
+                except Exception:
+                    self._drop_live(entries)
+                    log.exception('due index: firing %d entries failed; the polling sweep will catch up', len(entries))
+
+    # ---- lifecycle -----------------------------------------------------------
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        db = SessionLocal()
+        try:
+            # In leader mode the heap stays empty until a tick this worker leads syncs it
+            if settings.scheduler_mode != 'leader':
+                self.sync(db)
+        finally:
+            db.close()
+        self._thread = threading.Thread(target=self._run, name='due-index', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._leading = False
+            self._synced_at = self._until = 0.0
+            self._heap.clear()
+            self._generations.clear()
+            self._live.clear()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+index = DueIndex()
+
+push_many = index.push_many
+cancel_dose = index.cancel_dose
+cancel_medication = index.cancel_medication
+reload_medication = index.reload_medication
@@ -0,0 +1,150 @@
+# Live per-user events pushed to clients over SSE (GET /reminders/events).
+# Producers run anywhere - the due index thread, scheduler jobs, request
+# handlers in the threadpool - and hop onto the app's event loop with
+# call_soon_threadsafe; nothing here blocks the caller.
+#
+# A connection costs one small bounded asyncio.Queue in the registry (plus the
+# response generator), so a worker can hold tens of thousands of idle streams.
+# When a queue is full the oldest event is dropped: the stream is a hint to
+# refetch, the database stays the source of truth.
+#
+# With EVENTS_BACKEND=redis every event is published to one channel and each
+# worker delivers it to its own subscribers, so an event raised by the
+# scheduler leader reaches streams held by any worker.
+
+import asyncio
+import json
+import logging
+from typing import Iterable, Optional
+
+from ..config import settings
+
+log = logging.getLogger(__name__)
+
+CHANNEL = 'medication-assistant:events'
+
+DOSE_DUE = 'dose_due'
+DOSE_MISSED = 'dose_missed'
+SCHEDULE_CHANGED = 'schedule_changed'
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self._pending: set[asyncio.Task] = set()
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    # ---- subscribers (event loop) --------------------------------------------
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.events_queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def _deliver(self, user_id: int, event: dict) -> None:
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.stats['dropped'] += 1
+            queue.put_nowait(event)
+            self.stats['delivered'] += 1
+
+    # ---- producers (any thread) ----------------------------------------------
+
+    def publish(self, user_id: int, event_type: str, **data) -> None:
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._route, user_id, {'type': event_type, **data})
+
+    def _route(self, user_id: int, event: dict) -> None:
+        self.stats['published'] += 1
+        if self._redis is None:
+            self._deliver(user_id, event)
+            return
+        task = asyncio.ensure_future(self._redis.publish(CHANNEL, json.dumps({'user_id': user_id, 'event': event})))
+        self._pending.add(task)
+        task.add_done_callback(self._published)
+
+    def _published(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning('event publish failed: %s', task.exception())
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        payload = json.loads(message['data'])
+                        self._deliver(payload['user_id'], payload['event'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('event relay lost its redis subscription; retrying')
+                await asyncio.sleep(1)
+
+    # ---- lifecycle -----------------------------------------------------------
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        if settings.events_backend == 'redis':
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("EVENTS_BACKEND=redis requires the 'redis' package") from e
+            self._redis = aioredis.from_url(settings.events_redis_url, decode_responses=True)
+            self._listener = asyncio.create_task(self._listen())
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        self._loop = None
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def snapshot(self) -> dict:
+        return {
+            'backend': settings.events_backend,
+            'users': len(self._subscribers),
+            'connections': sum(len(q) for q in self._subscribers.values()),
+            **self.stats,
+        }
+
+
+hub = EventHub()
+
+subscribe = hub.subscribe
+unsubscribe = hub.unsubscribe
+publish = hub.publish
+
+
+def publish_missed(owners: dict[int, int], rows: Iterable) -> None:
+    """Publish dose_missed for (dose_id, medication_id, scheduled_at) rows; owners maps medication -> user."""
+    for dose_id, med_id, scheduled_at in rows:
+        publish(owners[med_id], DOSE_MISSED, dose_id=dose_id, medication_id=med_id,
+                scheduled_at=scheduled_at.isoformat())
+
+
+def events_stats() -> dict:
+    return hub.snapshot()
@@ -0,0 +1,299 @@
+"""
+Admission control and failure handling in front of services.azure_openai.
+
+- Concurrency: at most LLM_MAX_CONCURRENCY upstream calls per process and
+  LLM_MAX_PER_USER per user. Callers beyond that wait in a queue of at most
+  LLM_MAX_QUEUE for up to LLM_QUEUE_TIMEOUT_SECONDS; past either bound they get
+  503 + Retry-After at once.
+- Coalescing: a chat request identical to one already in flight (same cache key)
+  awaits that call instead of making its own.
+- Retries: 429s, timeouts, connection errors and 5xx are retried up to
+  AZURE_OPENAI_MAX_RETRIES times with jittered exponential backoff; a 429's
+  Retry-After (or retry-after-ms) is honored when it is within
+  LLM_RETRY_AFTER_MAX_SECONDS, otherwise the 503 passes it on to the client.
+- Circuit breaker: LLM_BREAKER_FAILURES consecutive failed upstream attempts open
+  the circuit for LLM_BREAKER_RESET_SECONDS, during which calls fail fast with 503;
+  one probe call is then let through and closes it again on success.
+
+Other upstream errors (4xx apart from 429) become 502 and are not retried.
+"""
+import asyncio
+import email.utils
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, status
+
+from ..config import settings
+from . import azure_openai, metrics
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+
+def _unavailable(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={'Retry-After': str(max(1, round(retry_after)))},
+    )
+
+
+def _retry_after(exc) -> Optional[float]:
+    """Seconds the server asked us to wait, from retry-after-ms or Retry-After."""
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _classify(exc) -> Optional[str]:
+    """Retry reason for a transient upstream failure, None for errors not worth retrying."""
+    import openai
+
+    if isinstance(exc, openai.RateLimitError):
+        return 'throttled'
+    if isinstance(exc, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(exc, openai.APIConnectionError):
+        return 'connection'
+    if isinstance(exc, openai.APIStatusError) and exc.status_code >= 500:
+        return 'server_error'
+    return None
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def check(self) -> bool:
+        """Raise 503 while open; after the cool-down admit a single probe call (returns True for it)."""
+        if self.state == OPEN:
+            if self.retry_in() > 0:
+                raise _unavailable('AI service unavailable, retry shortly', self.retry_in())
+            self.state, self._probing = HALF_OPEN, False
+        if self.state == HALF_OPEN:
+            if self._probing:
+                raise _unavailable('AI service recovering, retry shortly', 1)
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """The probe was cancelled before an outcome: the next call probes instead."""
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def record_success(self) -> None:
+        self.state, self._consecutive, self._probing = CLOSED, 0, False
+
+    def record_failure(self) -> None:
+        self._consecutive += 1
+        if self.state == HALF_OPEN or self._consecutive >= self.failures:
+            self.state, self._opened_at, self._probing = OPEN, time.monotonic(), False
+
+
+class LLMGateway:
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_reset_seconds)
+        self._global = asyncio.Semaphore(settings.llm_max_concurrency)
+        self._users: dict[int, list] = {}  # user_id -> [Semaphore, holders + waiters]
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.waiting = 0
+        self.active = 0
+        self.coalesced = 0
+
+    def admit(self) -> None:
+        """Fail fast (503) when a call would be rejected anyway; for callers that must decide up front."""
+        if self.breaker.state == OPEN and self.breaker.retry_in() > 0:
+            raise _unavailable('AI service unavailable, retry shortly', self.breaker.retry_in())
+        if self.waiting >= settings.llm_max_queue:
+            metrics.LLM_REJECTED.inc(1, ('queue_full',))
+            raise _unavailable('AI service busy, retry shortly', settings.llm_queue_timeout_seconds)
+
+    def _user_semaphore(self, user_id: int) -> asyncio.Semaphore:
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = [asyncio.Semaphore(settings.llm_max_per_user), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_user(self, user_id: int) -> None:
+        entry = self._users[user_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._users[user_id]
+
+    @asynccontextmanager
+    async def _slot(self, user_id: Optional[int]):
+        """Hold a global (and per-user) concurrency slot, waiting in the bounded queue if needed."""
+        self.admit()
+        user_sem = self._user_semaphore(user_id) if user_id is not None else None
+        acquired = []
+        try:
+            self.waiting += 1
+            started = time.perf_counter()
+            try:
+                deadline = time.monotonic() + settings.llm_queue_timeout_seconds
+                for sem in (user_sem, self._global):
+                    if sem is not None:
+                        await asyncio.wait_for(sem.acquire(), max(0.0, deadline - time.monotonic()))
+                        acquired.append(sem)
+            except asyncio.TimeoutError:
+                metrics.LLM_QUEUE_SECONDS.observe(time.perf_counter() - started, ('timeout',))
+                metrics.LLM_REJECTED.inc(1, ('queue_timeout',))
+                raise _unavailable('AI service busy, retry shortly', settings.llm_queue_timeout_seconds) from None
+            finally:
+                self.waiting -= 1
+            metrics.LLM_QUEUE_SECONDS.observe(time.perf_counter() - started, ('admitted',))
+
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+        finally:
+            for sem in acquired:
+                sem.release()
+            if user_id is not None:
+                self._release_user(user_id)
+
+    def _failed(self, exc, attempt: int) -> float:
+        """Record a failed attempt; return the delay before retrying, or raise the final error."""
+        reason = _classify(exc)
+        if reason is None:
+            # Our request was refused (bad input, content filter, auth); upstream itself is healthy
+            self.breaker.record_success()
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f'AI error: {exc}') from exc
+        metrics.LLM_RETRIES.inc(1, (reason,))
+        self.breaker.record_failure()
+        retry_after = _retry_after(exc) if reason == 'throttled' else None
+        if attempt >= settings.azure_openai_max_retries:
+            raise _unavailable(f'AI service unavailable ({reason}), retry shortly', retry_after or 1) from exc
+        if retry_after is not None:
+            if retry_after > settings.llm_retry_after_max_seconds:
+                raise _unavailable('AI service is rate limited, retry later', retry_after) from exc
+            return retry_after
+        ceiling = min(settings.llm_backoff_max_seconds, settings.llm_backoff_base_seconds * 2 ** attempt)
+        return random.uniform(ceiling / 2, ceiling)
+
+    async def _call(self, messages: list[dict], user_id: Optional[int]) -> str:
+        async with self._slot(user_id):
+            attempt = 0
+            while True:
+                probe = self.breaker.check()
+                try:
+                    reply = await azure_openai.chat(messages)
+                except Exception as e:
+                    delay = self._failed(e, attempt)
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    # Cancelled (unshielded call, client gone): says nothing about upstream
+                    if probe:
+                        self.breaker.release_probe()
+                    raise
+                self.breaker.record_success()
+                return reply
+
+    async def chat(self, messages: list[dict], user_id: Optional[int] = None, key: Optional[str] = None) -> str:
+        """Reply text; identical concurrent requests (same `key`) share one upstream call."""
+        if key is None:
+            return await self._call(messages, user_id)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(messages, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+            metrics.LLM_COALESCED.inc()
+        # Shielded so one waiter disconnecting does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter has gone away
+
+    async def chat_stream(self, messages: list[dict], user_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Reply fragments; failures before the first fragment are retried, later ones are raised."""
+        async with self._slot(user_id):
+            attempt = 0
+            while True:
+                probe = self.breaker.check()
+                stream = azure_openai.chat_stream(messages)
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    return
+                except Exception as e:
+                    await stream.aclose()
+                    delay = self._failed(e, attempt)
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    # Cancelled before the first fragment: says nothing about upstream
+                    if probe:
+                        self.breaker.release_probe()
+                    await stream.aclose()
+                    raise
+                try:
+                    yield first
+                    async for delta in stream:
+                        yield delta
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                except BaseException:
+                    # The client went away (GeneratorExit/cancel) mid-reply; upstream did answer
+                    self.breaker.record_success()
+                    raise
+                finally:
+                    await stream.aclose()
+                self.breaker.record_success()
+                return
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'inflight_keys': len(self._inflight),
+            'coalesced': self.coalesced,
+            'breaker': self.breaker.state,
+            'max_concurrency': settings.llm_max_concurrency,
+            'max_per_user': settings.llm_max_per_user,
+            'max_queue': settings.llm_max_queue,
+        }
+
+
+gateway = LLMGateway()
+chat = gateway.chat
+chat_stream = gateway.chat_stream
+gateway_stats = gateway.stats
@@ -0,0 +1,409 @@
+"""
+Process metrics in the Prometheus text format, served by GET /metrics.
+
+A small in-process registry (no client library): counters, gauges and
+histograms updated on the hot path, plus collectors that read the existing
+stats snapshots (pool, password hasher, notifier, chat cache, events, due
+index) at scrape time.
+
+MetricsMiddleware times every request per route template. SQLAlchemy
+cursor-execute hooks on every Engine count queries and DB time globally and,
+through a context variable, per request - a route whose query count grows with
+the data is an N+1. With SLOW_REQUEST_MS set, requests slower than that are
+logged together with the SQL statements they ran.
+
+Each worker process keeps its own registry; scrape every worker (or use one
+worker per pod) as with any multi-process Python service.
+"""
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (seconds) for latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds for the per-request query count histogram
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 3000, 4000, 8000, 16000)
+
+_lock = threading.Lock()
+_registry: list['_Metric'] = []
+_collectors: list[Callable[[], Iterable[str]]] = []
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Iterable[str], values: Iterable, extra: str = '') -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with _lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels: tuple, value) -> list[str]:
+        return [f'{self.name}{_labels(self.labelnames, labels)} {_fmt(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, labels: tuple = ()) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, labels: tuple = ()) -> None:
+        with _lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, labels: tuple = ()) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, labels: tuple, value) -> list[str]:
+        counts, total, count = value
+        return _histogram_samples(self.name, self.labelnames, labels, zip(self.buckets, counts), total, count)
+
+
+def _histogram_samples(name, labelnames, labels, bucket_counts, total, count) -> list[str]:
+    """Render non-cumulative (bound, count) pairs as cumulative Prometheus buckets."""
+    lines, running = [], 0
+    for bound, n in bucket_counts:
+        running += n
+        le = 'le="%s"' % bound
+        lines.append(f'{name}_bucket{_labels(labelnames, labels, le)} {running}')
+    le = 'le="+Inf"'
+    lines.append(f'{name}_bucket{_labels(labelnames, labels, le)} {count}')
+    lines.append(f'{name}_sum{_labels(labelnames, labels)} {_fmt(total)}')
+    lines.append(f'{name}_count{_labels(labelnames, labels)} {count}')
+    return lines
+
+
+def _snapshot_lines(name: str, help: str, kind: str, value: float, labelnames=(), labels=()) -> list[str]:
+    return [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name}{_labels(labelnames, labels)} {_fmt(value)}']
+
+
+def collector(fn: Callable[[], Iterable[str]]) -> Callable[[], Iterable[str]]:
+    """Register fn to produce exposition lines at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for fn in _collectors:
+        try:
+            lines.extend(fn())
+        except Exception:
+            log.exception('metrics collector %s failed', fn.__name__)
+    return '\n'.join(lines) + '\n'
+
+
+# ---- HTTP ------------------------------------------------------------------
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status'))
+HTTP_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency until the response is complete.',
+                         ('method', 'route'))
+HTTP_IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests (and open streams) being served.')
+HTTP_DB_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request.',
+                            ('method', 'route'), QUERY_COUNT_BUCKETS)
+HTTP_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent executing SQL per request.', ('method', 'route'))
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    statements: Optional[list[str]] = None  # collected only when the slow-request log is on
+
+
+# Set per request by the middleware; the threadpool and AsyncSession.run_sync both
+# run with a copy of the request's context, so the hooks below see the same object.
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar('request_stats', default=None)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so the context variable is shared with the endpoint."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(statements=[] if settings.slow_request_ms > 0 else None)
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_PROGRESS.inc(-1)
+            _request_stats.reset(token)
+            # FastAPI stores the matched route in the scope; label by its template, not the raw path
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            labels = (scope['method'], route)
+            HTTP_REQUESTS.inc(labels=(*labels, str(status)))
+            HTTP_SECONDS.observe(elapsed, labels)
+            HTTP_DB_QUERIES.observe(stats.queries, labels)
+            HTTP_DB_SECONDS.observe(stats.db_seconds, labels)
+            if stats.statements is not None and elapsed * 1000 >= settings.slow_request_ms:
+                log.warning(
+                    'slow request %s %s: %.0f ms, %d queries, %.0f ms in SQL\n%s',
+                    scope['method'], scope['path'], elapsed * 1000, stats.queries, stats.db_seconds * 1000,
+                    '\n'.join(stats.statements),
+                )
+
+
+# ---- SQL -------------------------------------------------------------------
+
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed.')
+DB_SECONDS = Histogram('db_query_duration_seconds', 'SQL statement latency.')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    DB_QUERIES.inc()
+    DB_SECONDS.observe(elapsed)
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < settings.slow_request_max_statements:
+        stats.statements.append(f'  {elapsed * 1000:7.1f} ms  {" ".join(statement.split())}')
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# ---- scheduler -------------------------------------------------------------
+
+TICK_SECONDS = Histogram('scheduler_tick_duration_seconds', 'Scheduler tick duration (passes run in this process).')
+TICK_LAST_SECONDS = Gauge('scheduler_tick_last_duration_seconds', 'Duration of the most recent scheduler tick.')
+TICK_LAST_ROWS = Gauge('scheduler_tick_last_rows', 'Doses generated or marked missed by the most recent tick.',
+                       ('kind',))
+TICK_ROWS = Counter('scheduler_tick_rows_total', 'Doses generated or marked missed by scheduler ticks.', ('kind',))
+
+
+def observe_tick(seconds: float, generated: int, missed: int) -> None:
+    TICK_SECONDS.observe(seconds)
+    TICK_LAST_SECONDS.set(seconds)
+    for kind, rows in (('generated', generated), ('missed', missed)):
+        TICK_LAST_ROWS.set(rows, (kind,))
+        TICK_ROWS.inc(rows, (kind,))
+
+
+# ---- Azure OpenAI ----------------------------------------------------------
+
+OPENAI_SECONDS = Histogram('openai_request_duration_seconds', 'Azure OpenAI call latency.', ('operation', 'outcome'))
+OPENAI_TOKENS = Counter('openai_tokens_total', 'Azure OpenAI tokens used.', ('kind',))
+
+
+def observe_openai(operation: str, seconds: float, ok: bool, usage=None) -> None:
+    OPENAI_SECONDS.observe(seconds, (operation, 'ok' if ok else 'error'))
+    if usage is not None:
+        OPENAI_TOKENS.inc(usage.prompt_tokens or 0, ('prompt',))
+        OPENAI_TOKENS.inc(usage.completion_tokens or 0, ('completion',))
+
+
+CHAT_PROMPT_TOKENS = Histogram('chat_prompt_tokens', 'Prompt size sent for a chat turn, after trimming (counted locally).',
+                               ('endpoint',), TOKEN_BUCKETS)
+CHAT_TRIMMED = Counter('chat_trimmed_messages_total', 'Conversation messages dropped to fit the chat token budget.',
+                       ('endpoint',))
+
+
+LLM_QUEUE_SECONDS = Histogram('llm_queue_wait_seconds', 'Time chat calls waited for a gateway concurrency slot.',
+                              ('outcome',))
+LLM_REJECTED = Counter('llm_rejected_total', 'Chat calls rejected by the gateway with 503 before reaching Azure.',
+                       ('reason',))
+LLM_RETRIES = Counter('llm_upstream_failures_total', 'Transient Azure OpenAI failures (each retried unless the last).',
+                      ('reason',))
+LLM_COALESCED = Counter('llm_coalesced_total', 'Chat calls served by an identical call already in flight.')
+
+
+def observe_prompt(endpoint: str, tokens: int, dropped: int) -> None:
+    CHAT_PROMPT_TOKENS.observe(tokens, (endpoint,))
+    if dropped:
+        CHAT_TRIMMED.inc(dropped, (endpoint,))
+
+
+# ---- scrape-time collectors -------------------------------------------------
+
+@collector
+def _pool_lines() -> list[str]:
+    from .. import database
+    lines = ['# HELP db_pool_connections Connection pool state.', '# TYPE db_pool_connections gauge']
+    engines = [('sync', database.engine)]
+    if database._async_engine is not None:
+        engines.append(('async', database._async_engine.sync_engine))
+    for name, engine in engines:
+        pool = engine.pool
+        # SQLite's default pools don't expose sizing
+        for state in ('size', 'checkedin', 'checkedout', 'overflow'):
+            fn = getattr(pool, state, None)
+            if fn is not None:
+                lines.append(f'db_pool_connections{{engine="{name}",state="{state}"}} {fn()}')
+    return lines
+
+
+@collector
+def _hasher_lines() -> list[str]:
+    from . import password_hasher
+    s = password_hasher.stats
+    return [
+        *_snapshot_lines('password_hash_pending', 'Hash/verify calls in the process pool.', 'gauge', s['pending']),
+        *_snapshot_lines('password_hash_rejected_total', 'Hash/verify calls rejected with 503.', 'counter', s['rejected']),
+        '# HELP login_duration_seconds Login latency including password verification.',
+        '# TYPE login_duration_seconds histogram',
+        *_histogram_samples('login_duration_seconds', (), (), s['login_buckets'].items(),
+                            s['login_seconds_sum'], s['login_count']),
+    ]
+
+
+@collector
+def _notifier_lines() -> list[str]:
+    from .notifier import notifier_stats
+    s = notifier_stats()
+    lines = _snapshot_lines('notify_queue_depth', 'Notifications waiting for a worker.', 'gauge', s['queue_depth'])
+    lines += ['# HELP notify_messages_total Notification pipeline events.', '# TYPE notify_messages_total counter']
+    lines += [f'notify_messages_total{{event="{k}"}} {s[k]}' for k in ('queued', 'merged', 'sent', 'retried', 'failed', 'dropped')]
+    lines += ['# HELP notify_delivery_seconds Time from enqueue to provider acceptance.',
+              '# TYPE notify_delivery_seconds histogram']
+    lines += _histogram_samples('notify_delivery_seconds', (), (), ((float(b), n) for b, n in s['latency_buckets'].items()),
+                                s['latency_seconds_sum'], s['latency_count'])
+    return lines
+
+
+@collector
+def _chat_cache_lines() -> list[str]:
+    from .chat_cache import cache_stats
+    s = cache_stats()
+    lines = ['# HELP chat_cache_lookups_total Chat reply cache lookups.', '# TYPE chat_cache_lookups_total counter',
+             f'chat_cache_lookups_total{{result="hit"}} {s["hits"]}',
+             f'chat_cache_lookups_total{{result="miss"}} {s["misses"]}']
+    if s['entries'] is not None:
+        lines += _snapshot_lines('chat_cache_entries', 'Entries in the in-memory chat cache.', 'gauge', s['entries'])
+    from .chat_context import summary_stats
+    s = summary_stats()
+    lines += ['# HELP chat_summary_lookups_total Cached per-user medication summary lookups.',
+              '# TYPE chat_summary_lookups_total counter',
+              f'chat_summary_lookups_total{{result="hit"}} {s["hits"]}',
+              f'chat_summary_lookups_total{{result="miss"}} {s["misses"]}',
+              *_snapshot_lines('chat_summary_entries', 'Per-user medication summaries cached.', 'gauge', s['entries'])]
+    return lines
+
+
+@collector
+def _analytics_lines() -> list[str]:
+    from .analytics import cache
+    s = cache.stats()
+    return ['# HELP analytics_cache_lookups_total Adherence analytics cache lookups.',
+            '# TYPE analytics_cache_lookups_total counter',
+            f'analytics_cache_lookups_total{{result="hit"}} {s["hits"]}',
+            f'analytics_cache_lookups_total{{result="miss"}} {s["misses"]}',
+            *_snapshot_lines('analytics_cache_entries', 'Adherence analytics results cached.', 'gauge', s['entries'])]
+
+
+@collector
+def _llm_lines() -> list[str]:
+    from .llm_gateway import gateway_stats
+    s = gateway_stats()
+    lines = [
+        *_snapshot_lines('llm_active_calls', 'Chat calls holding a gateway slot.', 'gauge', s['active']),
+        *_snapshot_lines('llm_waiting_calls', 'Chat calls queued for a gateway slot.', 'gauge', s['waiting']),
+        '# HELP llm_circuit_state Gateway circuit breaker state (1 for the current state).',
+        '# TYPE llm_circuit_state gauge',
+    ]
+    for state in ('closed', 'half_open', 'open'):
+        lines.append(f'llm_circuit_state{{state="{state}"}} {int(s["breaker"] == state)}')
+    return lines
+
+
+@collector
+def _live_lines() -> list[str]:
+    from . import due_index, events
+    s = events.events_stats()
+    return [
+        *_snapshot_lines('events_connections', 'Open live event streams.', 'gauge', s['connections']),
+        *_snapshot_lines('events_dropped_total', 'Live events dropped from full stream queues.', 'counter', s['dropped']),
+        *_snapshot_lines('due_index_entries', 'Pending doses held in the due-index timer heap.', 'gauge', len(due_index.index)),
+    ]
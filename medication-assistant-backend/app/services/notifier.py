@@ -1,6 +1,275 @@
-# Placeholder for email/SMS/push notifications.
-# Implement with providers like SendGrid, Twilio, or Web Push if needed.
+# Email/SMS/push notifications.
+# Messages go through an asynchronous dispatch pipeline running on its own thread
+# and event loop, so callers (scheduler, due index) never wait on provider I/O:
+#   send_notification -> merge buffer (same user, same minute) -> bounded queue
+#   -> worker pool -> per-provider token bucket -> provider.send, retried with backoff.
+# Implement real providers (SendGrid, Twilio, Web Push) against the Provider interface.
 
-def send_notification(user_email: str, subject: str, body: str):
-    # For now, just print to logs (replace with real provider)
-    print(f"[NOTIFY] To: {user_email} | {subject} => {body}")
+import asyncio
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Protocol
+
+from ..config import settings
+
+log = logging.getLogger(__name__)
+
+
+class Provider(Protocol):
+    name: str
+    rate_per_second: float
+
+    async def send(self, to: str, subject: str, body: str) -> None:
+        ...
+
+
+class LogProvider:
+    """Prints to stdout; the default until a real provider is configured."""
+    name = 'log'
+
+    def __init__(self, rate_per_second: float):
+        self.rate_per_second = rate_per_second
+
+    async def send(self, to: str, subject: str, body: str) -> None:
+        print(f"[NOTIFY] To: {to} | {subject} => {body}")
+
+
+class FileProvider:
+    """Appends one JSON line per message; a local loopback for tests and benchmarks."""
+    name = 'file'
+
+    def __init__(self, path: str, rate_per_second: float):
+        self.path = path
+        self.rate_per_second = rate_per_second
+
+    async def send(self, to: str, subject: str, body: str) -> None:
+        line = json.dumps({'to': to, 'subject': subject, 'body': body, 'sent_at': time.time()})
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+def _make_provider() -> Provider:
+    if settings.notify_provider == 'file':
+        return FileProvider(settings.notify_file_path, settings.notify_rate_per_second)
+    return LogProvider(settings.notify_rate_per_second)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float):
+        self.rate = rate_per_second
+        self.tokens = rate_per_second
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class Message:
+    to: str
+    subjects: list[str]
+    bodies: list[str]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+    @property
+    def subject(self) -> str:
+        if len(self.subjects) == 1:
+            return self.subjects[0]
+        return f"{len(self.subjects)} medication reminders"
+
+    @property
+    def body(self) -> str:
+        if len(self.bodies) == 1:
+            return self.bodies[0]
+        return '\n'.join(f"{s}: {b}" for s, b in zip(self.subjects, self.bodies))
+
+
+# Upper bounds (seconds) for the delivery latency histogram
+LATENCY_BUCKETS = (0.1, 0.5, 1.0, 5.0, 30.0, 120.0)
+
+
+class Dispatcher:
+    def __init__(self):
+        self.provider: Optional[Provider] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._merging: dict[tuple[str, datetime], Message] = {}
+        self._workers: list[asyncio.Task] = []
+        self._inflight_retries = 0
+        self.stats = {
+            'queued': 0, 'merged': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'dropped': 0,
+            'latency_count': 0, 'latency_seconds_sum': 0.0,
+            'latency_buckets': {b: 0 for b in LATENCY_BUCKETS},
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    # ---- producer side (any thread) ------------------------------------------
+
+    def submit(self, to: str, subject: str, body: str, due_at: Optional[datetime] = None) -> None:
+        self._loop.call_soon_threadsafe(self._accept, to, subject, body, due_at)
+
+    def _accept(self, to: str, subject: str, body: str, due_at: Optional[datetime]) -> None:
+        if due_at is None:
+            self._enqueue(Message(to, [subject], [body]))
+            return
+        key = (to, due_at.replace(second=0, microsecond=0))
+        pending = self._merging.get(key)
+        if pending is not None:
+            pending.subjects.append(subject)
+            pending.bodies.append(body)
+            self.stats['merged'] += 1
+            return
+        self._merging[key] = Message(to, [subject], [body])
+        self._loop.call_later(settings.notify_merge_window_seconds, self._flush_merged, key)
+
+    def _flush_merged(self, key) -> None:
+        message = self._merging.pop(key, None)
+        if message is not None:
+            self._enqueue(message)
+
+    def _enqueue(self, message: Message) -> None:
+        try:
+            self._queue.put_nowait(message)
+            self.stats['queued'] += 1
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            log.warning('notification queue full; dropped message to %s', message.to)
+
+    # ---- consumer side (dispatcher loop) -------------------------------------
+
+    async def _worker(self, bucket: TokenBucket) -> None:
+        while True:
+            message = await self._queue.get()
+            try:
+                await bucket.acquire()
+                message.attempts += 1
+                await asyncio.wait_for(
+                    self.provider.send(message.to, message.subject, message.body),
+                    timeout=settings.notify_timeout_seconds,
+                )
+                self._observe_delivery(time.monotonic() - message.enqueued_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._retry_later(message)
+            finally:
+                self._queue.task_done()
+
+    def _retry_later(self, message: Message) -> None:
+        if message.attempts >= settings.notify_max_attempts:
+            self.stats['failed'] += 1
+            log.exception('notification to %s failed after %d attempts', message.to, message.attempts)
+            return
+        self.stats['retried'] += 1
+        self._inflight_retries += 1
+        delay = settings.notify_backoff_seconds * (2 ** (message.attempts - 1))
+
+        def requeue():
+            self._inflight_retries -= 1
+            self._enqueue(message)
+
+        self._loop.call_later(delay, requeue)
+
+    def _observe_delivery(self, seconds: float) -> None:
+        self.stats['sent'] += 1
+        self.stats['latency_count'] += 1
+        self.stats['latency_seconds_sum'] += seconds
+        for bound in LATENCY_BUCKETS:
+            if seconds <= bound:
+                self.stats['latency_buckets'][bound] += 1
+                break
+
+    # ---- lifecycle -----------------------------------------------------------
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.provider = _make_provider()
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            self._queue = asyncio.Queue(maxsize=settings.notify_queue_size)
+            bucket = TokenBucket(self.provider.rate_per_second)
+            self._workers = [loop.create_task(self._worker(bucket)) for _ in range(settings.notify_workers)]
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='notifier', daemon=True)
+        self._thread.start()
+        ready.wait()
+        self._loop = loop
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush merge buffers, give the queue `timeout` seconds to drain, then stop."""
+        if not self.running:
+            return
+        loop = self._loop
+
+        async def drain():
+            for key in list(self._merging):
+                self._flush_merged(key)
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                log.warning('notifier stopped with %d queued messages', self._queue.qsize())
+            for w in self._workers:
+                w.cancel()
+
+        asyncio.run_coroutine_threadsafe(drain(), loop).result(timeout + 1)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=5)
+        loop.close()
+        self._loop = None
+        self._thread = None
+
+    def snapshot(self) -> dict:
+        return {
+            'provider': self.provider.name if self.provider else settings.notify_provider,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'merging': len(self._merging),
+            'retry_pending': self._inflight_retries,
+            **{k: v for k, v in self.stats.items() if k != 'latency_buckets'},
+            'latency_buckets': {str(b): n for b, n in self.stats['latency_buckets'].items()},
+        }
+
+
+dispatcher = Dispatcher()
+
+
+def send_notification(user_email: str, subject: str, body: str, due_at: Optional[datetime] = None):
+    """Queue a message; messages sharing user_email and the minute of due_at are merged."""
+    if not dispatcher.running:
+        # Dispatcher not started (scripts, one-off jobs): keep the old inline behaviour
+        print(f"[NOTIFY] To: {user_email} | {subject} => {body}")
+        return
+    dispatcher.submit(user_email, subject, body, due_at)
+
+
+def start() -> None:
+    dispatcher.start()
+
+
+def shutdown() -> None:
+    dispatcher.stop()
+
+
+def notifier_stats() -> dict:
+    return dispatcher.snapshot()
@@ -0,0 +1,104 @@
+"""
+Runs bcrypt hashing/verification in a bounded process pool.
+
+Each call costs ~250 ms of CPU; running it in the request threadpool lets a login
+burst starve every other endpoint. Calls beyond PASSWORD_HASH_MAX_PENDING are
+rejected with 503 + Retry-After instead of queueing without bound.
+
+Workers are spawned, not forked: by the time of a login the app runs the notifier,
+due-index and scheduler threads, and a child forked from a multithreaded process
+can inherit a lock held by one of them and hang. `start` (from the app lifespan)
+creates and warms the pool before those threads exist.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+from ..auth import get_password_hash, verify_password
+from ..config import settings
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending = 0
+
+# Upper bounds (seconds) for the login latency histogram
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+stats = {
+    'pending': 0,
+    'rejected': 0,
+    'login_count': 0,
+    'login_seconds_sum': 0.0,
+    'login_buckets': {b: 0 for b in LATENCY_BUCKETS},
+}
+
+
+def _worker_count() -> int:
+    if settings.password_hash_workers > 0:
+        return settings.password_hash_workers
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=_worker_count(), mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _warm() -> int:
+    return os.getpid()
+
+
+def start() -> None:
+    """Start every worker now (each imports the app once) rather than on the first logins."""
+    executor = _get_executor()
+    wait([executor.submit(_warm) for _ in range(_worker_count())])
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _submit(fn, *args):
+    global _pending
+    if _pending >= settings.password_hash_max_pending:
+        stats['rejected'] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Authentication service busy, retry shortly',
+            headers={'Retry-After': str(settings.password_hash_retry_after)},
+        )
+    _pending += 1
+    stats['pending'] = _pending
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+        stats['pending'] = _pending
+
+
+async def hash_password(password: str) -> str:
+    return await _submit(get_password_hash, password)
+
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    return await _submit(verify_password, password, hashed_password)
+
+
+def observe_login(seconds: float) -> None:
+    stats['login_count'] += 1
+    stats['login_seconds_sum'] += seconds
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            stats['login_buckets'][bound] += 1
+            break
@@ -0,0 +1,105 @@
+"""
+Compact schedule representation kept alongside the API's string fields.
+
+`Medication.weekday_mask` has bit N set when the medication is taken on weekday N
+(0 = Monday); `medication_times` holds one row per dose time as minutes since
+midnight. Both are written from `times_of_day` / `days_of_week` whenever a
+medication is saved, so the scheduler never parses JSON or CSV.
+
+Times of day and weekdays are wall-clock values in the owner's timezone
+(`User.timezone`); dose_logs store the resulting instants as naive UTC. The helpers
+at the bottom convert between the two.
+"""
+import json
+from datetime import date, datetime, timezone, tzinfo
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from .. import models
+
+ALL_DAYS_MASK = 0b1111111
+DEFAULT_TIMEZONE = 'UTC'
+
+
+def weekday_mask(days_of_week: str) -> int:
+    if days_of_week == 'all':
+        return ALL_DAYS_MASK
+    mask = 0
+    for x in days_of_week.split(','):
+        if x.strip() != '':
+            mask |= 1 << int(x)
+    return mask
+
+
+def minutes_of_day(times_of_day: list[str]) -> list[int]:
+    minutes = set()
+    for t in times_of_day:
+        hour, minute = map(int, t.split(':'))
+        minutes.add(hour * 60 + minute)
+    return sorted(minutes)
+
+
+def apply_schedule(med: models.Medication, times_of_day: list[str], days_of_week: str) -> None:
+    """Set both the API fields and the compact columns/rows on `med`."""
+    med.times_of_day = json.dumps(times_of_day)
+    med.days_of_week = days_of_week
+    med.weekday_mask = weekday_mask(days_of_week)
+    med.times = [models.MedicationTime(minute_of_day=m) for m in minutes_of_day(times_of_day)]
+
+
+def backfill(db) -> int:
+    """Populate weekday_mask and medication_times for rows saved before they existed."""
+    done = 0
+    while True:
+        meds = db.query(models.Medication).filter(models.Medication.weekday_mask.is_(None)).limit(1000).all()
+        if not meds:
+            return done
+        for med in meds:
+            try:
+                times = json.loads(med.times_of_day or '[]')
+                apply_schedule(med, times, med.days_of_week or 'all')
+            except (ValueError, TypeError):
+                # Unparseable legacy data: keep the row but never schedule it
+                med.weekday_mask = 0
+                med.times = []
+        db.commit()
+        done += len(meds)
+
+
+# ---- timezones ----
+
+def valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+@lru_cache(maxsize=1024)
+def zone(name: Optional[str]) -> tzinfo:
+    """The tzinfo for a User.timezone value; unset or unknown names mean UTC."""
+    if not name or name == DEFAULT_TIMEZONE or not valid_timezone(name):
+        return timezone.utc
+    return ZoneInfo(name)
+
+
+def local_date(tz: tzinfo, now: datetime) -> date:
+    """The date in `tz` at the naive UTC instant `now`."""
+    return now.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+
+def to_local(tz: tzinfo, at: datetime) -> datetime:
+    """Naive UTC `at` as naive wall-clock time in `tz`."""
+    return at.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
+
+
+def utc_slot(tz: tzinfo, day: date, minute: int) -> datetime:
+    """Naive UTC instant of wall-clock `minute` (since midnight) on `day` in `tz`.
+
+    A wall time skipped by a DST change resolves with the offset in force before it,
+    so the dose lands an hour later; a repeated wall time takes its first occurrence.
+    """
+    local = datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=tz)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
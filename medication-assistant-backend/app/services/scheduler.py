@@ -1,71 +1,340 @@
-from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import delete, insert, or_, select, update
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, date
-from dateutil import tz
-import json
+import random
+import time
+from typing import Optional
 
-from ..database import SessionLocal
+from ..config import settings
+from ..database import SessionLocal, dialect_insert
 from .. import models
+from . import adherence_rollup, archive, coordination, due_index, events, metrics, schedule, versions
 
-scheduler = BackgroundScheduler()
+# Created by start(), so importing this module (routers do) doesn't load APScheduler
+scheduler = None
 
 
-def _should_schedule_for_day(days_of_week: str, dt: date) -> bool:
-    if days_of_week == 'all':
-        return True
-    days = {int(x) for x in days_of_week.split(',') if x != ''}
-    return dt.weekday() in days
+def _make_scheduler():
+    # Jobs run in APScheduler's own threads with sync sessions in both DB modes: a
+    # tick is long batch work and would stall request handling on the event loop
+    from apscheduler.schedulers.background import BackgroundScheduler
+    return BackgroundScheduler()
 
 
-def generate_todays_schedules(db: Session):
-    today = date.today()
-    now = datetime.now(tz=tz.tzlocal()).replace(tzinfo=None)
-    meds = db.query(models.Medication).all()
-    for m in meds:
-        if m.start_date and today < m.start_date:
-            continue
-        if m.end_date and today > m.end_date:
-            continue
-        if not _should_schedule_for_day(m.days_of_week, today):
-            continue
-        try:
-            times = json.loads(m.times_of_day or '[]')
-        except Exception:
-            times = []
-        for t in times:
-            hour, minute = map(int, t.split(':'))
-            scheduled_at = datetime(today.year, today.month, today.day, hour, minute)
-            exists = db.query(models.DoseLog).filter(
-                models.DoseLog.medication_id == m.id,
-                models.DoseLog.scheduled_at == scheduled_at,
-            ).first()
-            if not exists:
-                db.add(models.DoseLog(medication_id=m.id, scheduled_at=scheduled_at, status='scheduled'))
+# (shard index, shard count): restricts a pass to medications with id % count == index
+Shard = Optional[tuple[int, int]]
+
+
+# Rows per INSERT statement when materialising dose slots
+INSERT_BATCH_SIZE = 1000
+# Medications per pass of generate_schedules (one commit each)
+MEDICATION_BATCH_SIZE = 1000
+
+
+def horizon_days() -> int:
+    # A refill must end past the refill threshold even for timezones a day behind UTC,
+    # or the same medications would be picked up again on every tick
+    return max(settings.schedule_horizon_days, settings.schedule_refill_days + 2)
+
+
+def generate_schedules(db: Session, shard: Shard = None, user_id: Optional[int] = None,
+                       medication_ids: Optional[list[int]] = None) -> int:
+    """Materialise dose slots up to horizon_days() ahead for the medications that need it.
+
+    `Medication.scheduled_through` records the last local date already materialised.
+    Only medications where it is unset (new, edited, or never scheduled) or within
+    SCHEDULE_REFILL_DAYS of today are selected, through its index, so a steady-state
+    tick is one query that finds nothing and each medication is topped up every few
+    days. Slots follow the owner's timezone, are stored as naive UTC and are never
+    created in the past. Inserts ignore unique-constraint conflicts, so concurrent
+    ticks cannot duplicate doses and slots already answered ahead of time are kept.
+    `user_id` / `medication_ids` narrow the run (e.g. /reminders/sync, a medication edit).
+    """
+    now = datetime.utcnow()
+    today = now.date()
+    med = models.Medication
+    query = (
+        select(med.id, med.user_id, models.User.timezone, med.weekday_mask, med.start_date, med.end_date,
+               med.scheduled_through)
+        .join(models.User, models.User.id == med.user_id)
+        .where(
+            or_(med.scheduled_through.is_(None),
+                med.scheduled_through < today + timedelta(days=settings.schedule_refill_days)),
+            # Ended before yesterday: past its last local date in every timezone
+            or_(med.end_date.is_(None), med.end_date >= today - timedelta(days=1)),
+        )
+        .limit(MEDICATION_BATCH_SIZE)
+    )
+    if shard is not None:
+        query = query.where(med.id % shard[1] == shard[0])
+    if user_id is not None:
+        query = query.where(med.user_id == user_id)
+    if medication_ids is not None:
+        query = query.where(med.id.in_(medication_ids))
+    generated = 0
+    while True:
+        # Each batch moves scheduled_through past the threshold, so the same query pages on
+        meds = db.execute(query).all()
+        if meds:
+            generated += _materialise(db, meds, now)
+        if len(meds) < MEDICATION_BATCH_SIZE:
+            return generated
+
+
+def _materialise(db: Session, meds, now: datetime) -> int:
+    ids = [m.id for m in meds]
+    times: dict[int, list[int]] = {}
+    for med_id, minute in db.execute(
+        select(models.MedicationTime.medication_id, models.MedicationTime.minute_of_day)
+        .where(models.MedicationTime.medication_id.in_(ids))
+    ):
+        times.setdefault(med_id, []).append(minute)
+    existing = set(db.execute(
+        select(models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+        .where(models.DoseLog.medication_id.in_(ids), models.DoseLog.scheduled_at >= now)
+    ).all())
+
+    horizon = horizon_days()
+    rows = []
+    owners = {}
+    through: dict[date, list[int]] = {}
+    for med_id, owner, tz_name, mask, start_date, end_date, scheduled_through in meds:
+        owners[med_id] = owner
+        tz = schedule.zone(tz_name)
+        local_today = schedule.local_date(tz, now)
+        last = local_today + timedelta(days=horizon - 1)
+        through.setdefault(last, []).append(med_id)
+        day = local_today if scheduled_through is None else max(local_today, scheduled_through + timedelta(days=1))
+        if start_date is not None:
+            day = max(day, start_date)
+        if end_date is not None:
+            last = min(last, end_date)
+        minutes = times.get(med_id, ())
+        while day <= last:
+            if (mask or 0) & (1 << day.weekday()):
+                for minute in minutes:
+                    at = schedule.utc_slot(tz, day, minute)
+                    if at >= now and (med_id, at) not in existing:
+                        rows.append({'medication_id': med_id, 'scheduled_at': at, 'status': 'scheduled'})
+            day += timedelta(days=1)
+
+    inserted = []
+    if rows:
+        stmt = dialect_insert(db, models.DoseLog)
+        if stmt is not None:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['medication_id', 'scheduled_at'])
+        else:
+            stmt = insert(models.DoseLog)
+        stmt = stmt.returning(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+
+        deltas = adherence_rollup.new_deltas()
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            for dose_id, med_id, at in db.execute(stmt, rows[i:i + INSERT_BATCH_SIZE]):
+                adherence_rollup.track(deltas, owners[med_id], med_id, at, None, 'scheduled')
+                inserted.append((dose_id, med_id, at))
+        adherence_rollup.apply(db, deltas)
+        versions.bump(db, (owners[med_id] for _, med_id, _ in inserted))
+    for last, med_ids in through.items():
+        db.execute(
+            update(models.Medication).where(models.Medication.id.in_(med_ids)).values(scheduled_through=last)
+            .execution_options(synchronize_session=False)
+        )
     db.commit()
+    due_index.push_many(inserted)
+    for owner in {owners[med_id] for _, med_id, _ in inserted}:
+        events.publish(owner, events.SCHEDULE_CHANGED, action='materialized')
+    return len(inserted)
 
 
-def check_missed_doses(db: Session):
+def clear_future_doses(db: Session, medication_ids: list[int]) -> int:
+    """Delete the medications' unanswered doses still ahead and reset their horizon (no commit).
+
+    Doses already taken or skipped ahead of time, and those past their slot, are
+    kept; generate_schedules then refills the freed slots from the current schedule.
+    Callers reload the medications in due_index after committing.
+    """
     now = datetime.utcnow()
-    pending = db.query(models.DoseLog).filter(models.DoseLog.status == 'scheduled', models.DoseLog.scheduled_at < now - timedelta(minutes=60)).all()
-    for d in pending:
-        d.status = 'missed'
-    if pending:
+    removed = db.execute(
+        delete(models.DoseLog)
+        .where(
+            models.DoseLog.medication_id.in_(medication_ids),
+            models.DoseLog.status == 'scheduled',
+            models.DoseLog.scheduled_at >= now,
+        )
+        .returning(models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if removed:
+        owners = dict(db.execute(
+            select(models.Medication.id, models.Medication.user_id).where(models.Medication.id.in_(medication_ids))
+        ).all())
+        deltas = adherence_rollup.new_deltas()
+        for med_id, at in removed:
+            adherence_rollup.track(deltas, owners[med_id], med_id, at, 'scheduled', None)
+        adherence_rollup.apply(db, deltas)
+    db.execute(
+        update(models.Medication).where(models.Medication.id.in_(medication_ids)).values(scheduled_through=None)
+        .execution_options(synchronize_session=False)
+    )
+    return len(removed)
+
+
+# Doses still 'scheduled' this long after their slot are flagged as missed
+MISSED_GRACE = timedelta(minutes=settings.missed_grace_minutes)
+# Upper bound on rows touched by a single UPDATE in the missed-dose sweep
+MISSED_SWEEP_BATCH_SIZE = 5000
+
+
+def check_missed_doses(db: Session, shard: Shard = None, user_id: Optional[int] = None) -> list[int]:
+    """Flip overdue 'scheduled' doses to 'missed' in bounded chunks.
+
+    Each chunk is one UPDATE ... RETURNING over at most MISSED_SWEEP_BATCH_SIZE ids
+    picked via ix_dose_logs_status_scheduled_at, so no DoseLog objects are loaded.
+    The daily rollup is updated in the same transaction as each chunk.
+    Returns the ids of every dose that was marked missed.
+    """
+    cutoff = datetime.utcnow() - MISSED_GRACE
+    overdue = select(models.DoseLog.id).where(
+        models.DoseLog.status == 'scheduled', models.DoseLog.scheduled_at < cutoff,
+    )
+    if shard is not None:
+        overdue = overdue.where(models.DoseLog.medication_id % shard[1] == shard[0])
+    if user_id is not None:
+        overdue = overdue.where(models.DoseLog.medication_id.in_(
+            select(models.Medication.id).where(models.Medication.user_id == user_id)
+        ))
+    overdue = overdue.limit(MISSED_SWEEP_BATCH_SIZE).scalar_subquery()
+    stmt = (
+        update(models.DoseLog)
+        # Status again on the outer WHERE: Postgres re-checks only that after waiting
+        # on a row a concurrent take just updated, never the subquery
+        .where(models.DoseLog.id.in_(overdue), models.DoseLog.status == 'scheduled')
+        .values(status='missed')
+        .returning(models.DoseLog.id, models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+        .execution_options(synchronize_session=False)
+    )
+    missed: list[int] = []
+    while True:
+        chunk = db.execute(stmt).all()
+        owners = adherence_rollup.record_missed(db, chunk)
         db.commit()
+        events.publish_missed(owners, chunk)
+        missed.extend(dose_id for dose_id, _, _ in chunk)
+        if len(chunk) < MISSED_SWEEP_BATCH_SIZE:
+            return missed
+
+
+def _period_end(now: datetime) -> datetime:
+    """End of the tick period containing `now` (periods are aligned to the epoch)."""
+    period = settings.scheduler_interval_minutes * 60
+    epoch = datetime(1970, 1, 1)
+    elapsed = int((now - epoch).total_seconds())
+    return epoch + timedelta(seconds=elapsed - elapsed % period + period)
+
+
+def run_tick(db: Session) -> int:
+    """Run one scheduler tick under SCHEDULER_MODE; returns the number of passes (shards) run here."""
+    started = time.perf_counter()
+    rows = {'generated': 0, 'missed': 0}
+
+    def run_pass(shard: Shard = None) -> None:
+        rows['generated'] += generate_schedules(db, shard)
+        rows['missed'] += len(check_missed_doses(db, shard))
+
+    passes = _run_passes(db, run_pass)
+    if passes:
+        metrics.observe_tick(time.perf_counter() - started, rows['generated'], rows['missed'])
+    return passes
+
+
+def _run_passes(db: Session, run_pass) -> int:
+    if settings.scheduler_mode == 'all':
+        due_index.index.sync(db)
+        run_pass()
+        return 1
+
+    lease_for = timedelta(seconds=settings.scheduler_lease_seconds)
+    if settings.scheduler_mode == 'leader':
+        # The leader renews every tick; a dead leader's lease lapses and another worker takes over
+        started = datetime.utcnow()
+        if not coordination.try_acquire(db, 'tick', started + lease_for):
+            due_index.index.resign()
+            return 0
+        due_index.index.sync(db)
+        run_pass()
+        # Ticks run on each worker's own interval timer, not on period boundaries: hold the
+        # lease past this worker's next tick so no other worker's tick takes it in between
+        interval = timedelta(minutes=settings.scheduler_interval_minutes)
+        coordination.hold_until(db, 'tick', started + interval + lease_for)
+        return 1
+
+    # Sharded: hold a shard while working on it, then keep it until the period ends
+    # so no other worker repeats it; workers ticking together split the shards.
+    count = settings.scheduler_shards
+    done = 0
+    for index in random.sample(range(count), count):
+        name = f'tick:{index}'
+        if not coordination.try_acquire(db, name, datetime.utcnow() + lease_for):
+            continue
+        try:
+            run_pass((index, count))
+        except Exception:
+            db.rollback()
+            coordination.release(db, name)
+            raise
+        coordination.hold_until(db, name, _period_end(datetime.utcnow()))
+        done += 1
+    return done
 
 
 def job_tick():
     db = SessionLocal()
     try:
-        generate_todays_schedules(db)
-        check_missed_doses(db)
+        run_tick(db)
+    finally:
+        db.close()
+
+
+def run_archive(db: Session) -> int:
+    """Move expired dose history to the archive; one worker per ARCHIVE_INTERVAL_HOURS via the 'archive' lease."""
+    interval = timedelta(hours=settings.archive_interval_hours)
+    # Held for the whole interval (minus slack for timer jitter) so other workers skip this round
+    if not coordination.try_acquire(db, 'archive', datetime.utcnow() + interval - timedelta(minutes=1)):
+        return 0
+    return archive.archive_old_doses(db)
+
+
+def job_archive():
+    db = SessionLocal()
+    try:
+        run_archive(db)
     finally:
         db.close()
 
 
 def start():
-    scheduler.add_job(job_tick, 'interval', minutes=5, id='tick', replace_existing=True)
+    global scheduler
+    # Legacy rows are backfilled by app.migrations, once per deploy
+    # Reminders/missed transitions fire from the timer heap at their exact time;
+    # the tick's missed sweep stays as an index-range safety net.
+    if settings.due_index_enabled and settings.scheduler_mode in ('all', 'leader'):
+        due_index.index.start()
+    scheduler = _make_scheduler()
+    scheduler.add_job(
+        job_tick, 'interval',
+        minutes=settings.scheduler_interval_minutes, id='tick', replace_existing=True,
+    )
+    scheduler.add_job(
+        job_archive, 'interval',
+        hours=settings.archive_interval_hours, id='archive', replace_existing=True,
+        next_run_time=datetime.now(),
+    )
     scheduler.start()
 
 
 def shutdown():
-    scheduler.shutdown()
+    global scheduler
+    if scheduler is not None:
+        scheduler.shutdown()
+        scheduler = None
+    due_index.index.stop()
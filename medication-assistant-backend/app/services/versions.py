@@ -0,0 +1,96 @@
+"""
+Per-user data versions for conditional GET.
+
+Every write that can change what a user's medication or dose listings return
+calls `bump` in the same transaction. Listings derive their ETag from the version
+(one primary-key read on user_data_versions), so an unchanged resource answers 304
+before the medication/dose tables are queried or anything is serialized.
+VersionedCache keeps derived per-user results valid on the same signal.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..database import dialect_insert
+from .. import models
+
+
+def bump(db: Session, user_ids: Iterable[int]) -> None:
+    """Increment the version of each user (no commit)."""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    stmt = dialect_insert(db, models.UserDataVersion)
+    if stmt is not None:
+        table = models.UserDataVersion.__table__
+        db.execute(
+            stmt.on_conflict_do_update(index_elements=['user_id'], set_={'version': table.c.version + 1}),
+            [{'user_id': uid, 'version': 1} for uid in user_ids],
+        )
+        return
+    for uid in user_ids:
+        row = db.get(models.UserDataVersion, uid)
+        if row is None:
+            db.add(models.UserDataVersion(user_id=uid, version=1))
+        else:
+            row.version += 1
+
+
+def current(db: Session, user_id: int) -> int:
+    return db.execute(
+        select(models.UserDataVersion.version).where(models.UserDataVersion.user_id == user_id)
+    ).scalar() or 0
+
+
+def etag(db: Session, user_id: int, *scope) -> str:
+    """Strong ETag for a user's resource; `scope` distinguishes resources and query parameters."""
+    raw = '|'.join(str(part) for part in (user_id, current(db, user_id), *scope))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def not_modified(request: Request, tag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = {c.strip().removeprefix('W/') for c in header.split(',')}
+    return tag in candidates or '*' in candidates
+
+
+class VersionedCache:
+    """Per-process LRU of values derived from a user's data: key -> (stamp, value).
+
+    The stamp is the user's version (plus anything else the value depends on); a
+    lookup with a different stamp is a miss, so writes invalidate without any hook.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[Any, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, stamp) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, stamp, value) -> None:
+        with self._lock:
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,14 @@
+"""
+Reproducible benchmarks. Run from the backend directory as modules:
+
+    python -m benchmarks.seed         seeded synthetic users, medications and dose history
+    python -m benchmarks.micro        scheduler passes and adherence query at several data sizes
+    python -m benchmarks.load         HTTP load driver (p50/p95/p99, throughput) with a stub OpenAI
+    python -m benchmarks.shards       sharded scheduler tick: duplicates and speedup per worker count
+    python -m benchmarks.startup      import time and time to first served request of a cold worker
+    python -m benchmarks.analytics    adherence analytics fetch/compute over ~1M dose rows of one user
+    python -m benchmarks.stub_openai  the stub Azure OpenAI endpoint on its own
+
+Every command takes --database-url (SQLite by default, or a local Postgres) and
+writes its results as JSON (--output), so runs can be compared across commits.
+"""
@@ -0,0 +1,105 @@
+"""
+GET /adherence/analytics at scale: one user with about a million dose rows.
+
+The defaults (760 medications over 730 days) seed roughly 1M dose_logs rows for
+a single user. Timed separately:
+
+  fetch           the columnar query (services.analytics.fetch)
+  compute         the NumPy pass over the fetched rows
+  python_loop     the same core figures computed row by row in Python, for reference
+  cached          a repeat request: version read plus cache lookup
+
+Retention is widened to cover the whole period so the rows stay in dose_logs.
+
+    python -m benchmarks.analytics --output analytics.json
+    python -m benchmarks.analytics --meds 76 --days 730 --repeat 5   # ~100k rows
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+from .common import DEFAULT_DATABASE_URL, configure, measure, reset_schema, write_results
+
+
+def python_loop(fetched) -> dict:
+    """Row-by-row version of the totals, streaks, weekday/hour and weekly trend figures (UTC user)."""
+    _, rows, _, _ = fetched
+    totals = defaultdict(int)
+    per_med = defaultdict(list)
+    weekday = defaultdict(lambda: [0, 0])
+    hour = defaultdict(lambda: [0, 0])
+    weeks = defaultdict(lambda: [0, 0])
+    lateness = []
+    for med, scheduled, taken_at, status in rows:
+        totals[status] += 1
+        if status not in (1, 2, 3):
+            continue
+        taken = status == 1
+        per_med[med].append((scheduled, taken))
+        day = scheduled // 86400
+        for bucket in (weekday[(day + 3) % 7], hour[(scheduled % 86400) // 3600], weeks[day - (day + 3) % 7]):
+            bucket[0] += 1
+            bucket[1] += taken
+        if taken and taken_at >= 0:
+            lateness.append((taken_at - scheduled) / 60.0)
+    streaks = {}
+    for med, doses in per_med.items():
+        doses.sort()
+        longest = run = 0
+        for _, taken in doses:
+            run = run + 1 if taken else 0
+            longest = max(longest, run)
+        streaks[med] = (longest, run)
+    lateness.sort()
+    return {'totals': dict(totals), 'streaks': streaks, 'median_lateness': lateness[len(lateness) // 2] if lateness else None,
+            'weeks': len(weeks)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--meds', type=int, default=760)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help="JSON results path, '-' for stdout")
+    args = parser.parse_args()
+
+    configure(args.database_url, DOSE_RETENTION_DAYS=str(args.days + 1))
+    from app.database import SessionLocal
+    from app.services import analytics, versions
+    from .seed import seed
+
+    reset_schema()
+    db = SessionLocal()
+    try:
+        counts = seed(db, 1, args.meds, args.days, args.seed)
+        since = analytics.since_for(args.days)
+        results = {'rows': counts}
+
+        results['fetch'], fetched = measure(lambda: analytics.fetch(db, 1, since), args.repeat)
+        results['compute'], computed = measure(lambda: analytics.compute(fetched, args.days, 'week'), args.repeat)
+        results['python_loop'], reference = measure(lambda: python_loop(fetched), args.repeat)
+        results['compute_speedup'] = round(results['python_loop']['mean_ms'] / results['compute']['mean_ms'], 1)
+
+        # Both paths must agree before their timings mean anything
+        by_med = {m['medication_id']: (m['longest_streak'], m['current_streak']) for m in computed['medications']}
+        assert by_med == reference['streaks'], 'streaks differ from the row-by-row reference'
+        assert computed['totals']['taken'] == reference['totals'].get(1, 0)
+        assert len(computed['trend']) == reference['weeks']
+
+        stamp = (versions.current(db, 1), datetime.utcnow().date())
+        analytics.cache.set((1, args.days, 'week'), stamp, computed)
+        results['cached'], _ = measure(
+            lambda: analytics.cache.get((1, args.days, 'week'), (versions.current(db, 1), datetime.utcnow().date())),
+            max(args.repeat, 20),
+        )
+    finally:
+        db.close()
+
+    params = {k: v for k, v in vars(args).items() if k != 'database_url'}
+    write_results(args.output, 'analytics', params, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Shared helpers: database selection, timing and the JSON result format."""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+DEFAULT_DATABASE_URL = 'sqlite:///./bench.db'
+
+
+def configure(database_url: str, **env: str) -> None:
+    """Point the app at `database_url`. Must run before anything under `app` is imported,
+    since app.config reads the environment once at import."""
+    if 'app.config' in sys.modules:
+        raise RuntimeError('benchmarks.common.configure() must be called before importing app')
+    os.environ['DATABASE_URL'] = database_url
+    # Keep benchmark output clean: no stdout notifications, no background jobs
+    os.environ.setdefault('NOTIFY_PROVIDER', 'file')
+    os.environ.setdefault('NOTIFY_FILE_PATH', os.devnull)
+    os.environ.update(env)
+
+
+def reset_schema() -> None:
+    from app.database import Base, engine
+    from app import migrations, models  # noqa: F401  (registers the tables on Base.metadata)
+    Base.metadata.drop_all(bind=engine)
+    migrations.create_schema()
+
+
+def summarize(samples: list[float]) -> dict:
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(pct(50) * 1000, 3),
+        'p95_ms': round(pct(95) * 1000, 3),
+        'p99_ms': round(pct(99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> tuple[dict, object]:
+    """Time `fn` `repeat` times, running the untimed `setup` before each call.
+    Returns the latency summary and the last return value of `fn`."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples), result
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def write_results(path: str, benchmark: str, params: dict, results) -> dict:
+    """Write one run as JSON. Files from different runs share this envelope, so they can be diffed or merged."""
+    from sqlalchemy.engine import make_url
+    doc = {
+        'benchmark': benchmark,
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': make_url(os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)).get_backend_name(),
+        'params': params,
+        'results': results,
+    }
+    text = json.dumps(doc, indent=2, default=str)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f'wrote {path}', file=sys.stderr)
+    return doc
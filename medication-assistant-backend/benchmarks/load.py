@@ -0,0 +1,196 @@
+"""
+HTTP load driver: concurrent virtual users against a running app, with latency
+percentiles and throughput per endpoint.
+
+Without --base-url it brings up its own stack: seeds --database-url, starts the
+stub OpenAI (benchmarks.stub_openai) and runs the app under uvicorn pointed at
+both. Extra app settings go through --env, e.g. --env DB_ASYNC=true.
+
+Each virtual user logs in as one seeded user, then all of them loop over a
+weighted mix of endpoints until --duration elapses. Logins are reported apart
+from the timed mix.
+
+    python -m benchmarks.load --users 200 --concurrency 50 --duration 30 --output load.json
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --users 200   # already seeded
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+
+from .common import DEFAULT_DATABASE_URL, summarize, write_results
+from .seed import PASSWORD, email_for
+
+CHAT_PROMPTS = (
+    'When should I take my next dose?',
+    'Can I take ibuprofen with my current medications?',
+    'What should I do if I miss a dose?',
+    'How can I remember my evening pills?',
+)
+
+# (weight, label) per request in the mix
+MIX = (
+    (30, 'GET /medications'),
+    (20, 'GET /medications/{id}/doses'),
+    (20, 'GET /adherence/stats'),
+    (10, 'POST /reminders/sync'),
+    (10, 'POST /chat'),
+)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.statuses[label][type(e).__name__] += 1
+            return None
+        self.samples[label].append(time.perf_counter() - start)
+        self.statuses[label][str(resp.status_code)] += 1
+        return resp
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label in sorted(self.samples.keys() | self.statuses.keys()):
+            samples = self.samples.get(label, [])
+            endpoints[label] = {
+                **summarize(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'statuses': dict(self.statuses[label]),
+            }
+        total = sum(len(s) for s in self.samples.values())
+        return {'elapsed_seconds': round(elapsed, 2), 'requests': total,
+                'throughput_rps': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+async def log_in(client: httpx.AsyncClient, rec: Recorder, user_id: int) -> Optional[tuple[dict, list[int]]]:
+    resp = await rec.call(client, 'POST /auth/login', 'POST', '/auth/login',
+                          json={'email': email_for(user_id), 'password': PASSWORD})
+    if resp is None or resp.status_code != 200:
+        return None
+    headers = {'Authorization': f"Bearer {resp.json()['access_token']}"}
+    resp = await rec.call(client, 'GET /medications', 'GET', '/medications', headers=headers)
+    med_ids = [m['id'] for m in resp.json()] if resp is not None and resp.status_code == 200 else []
+    return headers, med_ids
+
+
+async def virtual_user(client: httpx.AsyncClient, rec: Recorder, session, deadline: float, rng: random.Random) -> None:
+    if session is None:
+        return
+    headers, med_ids = session
+    weights = [w for w, _ in MIX]
+    labels = [label for _, label in MIX]
+    while time.monotonic() < deadline:
+        label = rng.choices(labels, weights)[0]
+        if label == 'GET /medications':
+            await rec.call(client, label, 'GET', '/medications', headers=headers)
+        elif label == 'GET /medications/{id}/doses':
+            if med_ids:
+                await rec.call(client, label, 'GET', f'/medications/{rng.choice(med_ids)}/doses',
+                               params={'days': 7, 'limit': 50}, headers=headers)
+        elif label == 'GET /adherence/stats':
+            await rec.call(client, label, 'GET', '/adherence/stats', params={'period_days': 30}, headers=headers)
+        elif label == 'POST /reminders/sync':
+            await rec.call(client, label, 'POST', '/reminders/sync', headers=headers)
+        elif label == 'POST /chat':
+            await rec.call(client, label, 'POST', '/chat', headers=headers,
+                           json={'messages': [{'role': 'user', 'content': rng.choice(CHAT_PROMPTS)}]})
+
+
+async def drive(base_url: str, users: int, concurrency: int, duration: float, seed_value: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        # Logins (bcrypt) are measured separately so they don't eat into the timed mix
+        logins = Recorder()
+        login_start = time.monotonic()
+        sessions = await asyncio.gather(*(log_in(client, logins, (i % users) + 1) for i in range(concurrency)))
+        login_elapsed = time.monotonic() - login_start
+        rec = Recorder()
+        start = time.monotonic()
+        deadline = start + duration
+        await asyncio.gather(*(
+            virtual_user(client, rec, session, deadline, random.Random(seed_value + i))
+            for i, session in enumerate(sessions)
+        ))
+        report = rec.report(time.monotonic() - start)
+        report['login'] = logins.report(login_elapsed)
+        return report
+
+
+def _wait_healthy(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'{url} exited with {proc.returncode} during startup')
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} did not become healthy in {timeout}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='drive an already running, already seeded app')
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--meds', type=int, default=3)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--stub-port', type=int, default=9100)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers for the spawned app')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='extra app setting')
+    parser.add_argument('--output', default='-', help="JSON results path, '-' for stdout")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', args.database_url)  # recorded in the results
+    procs: list[subprocess.Popen] = []
+    base_url = args.base_url
+    try:
+        if base_url is None:
+            subprocess.run([sys.executable, '-m', 'benchmarks.seed', '--database-url', args.database_url,
+                            '--users', str(args.users), '--meds', str(args.meds), '--days', str(args.days),
+                            '--seed', str(args.seed)], check=True)
+            stub = subprocess.Popen([sys.executable, '-m', 'benchmarks.stub_openai', '--port', str(args.stub_port)])
+            procs.append(stub)
+            _wait_healthy(f'http://127.0.0.1:{args.stub_port}/stats', stub)
+
+            env = dict(os.environ, DATABASE_URL=args.database_url,
+                       AZURE_OPENAI_ENDPOINT=f'http://127.0.0.1:{args.stub_port}', AZURE_OPENAI_API_KEY='stub',
+                       NOTIFY_PROVIDER='file', NOTIFY_FILE_PATH=os.devnull)
+            env.update(kv.split('=', 1) for kv in args.env)
+            app = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(args.port),
+                                    '--workers', str(args.workers), '--log-level', 'warning'], env=env)
+            procs.append(app)
+            base_url = f'http://127.0.0.1:{args.port}'
+            _wait_healthy(f'{base_url}/health', app)
+
+        results = asyncio.run(drive(base_url, args.users, args.concurrency, args.duration, args.seed))
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('database_url', 'base_url')}
+    write_results(args.output, 'load', params, results)
+
+
+if __name__ == '__main__':
+    main()
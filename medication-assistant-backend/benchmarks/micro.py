@@ -0,0 +1,112 @@
+"""
+Micro-benchmarks of the scheduler passes and the adherence query at several data sizes.
+
+For each size the schema is recreated and seeded, then each operation is timed
+against a warm connection:
+
+  generate_schedules              horizons reset before every run (full materialisation)
+  generate_schedules_noop         horizons current (the steady-state tick)
+  check_missed_doses              yesterday's doses reset to 'scheduled' before every run
+  check_missed_doses_noop         nothing overdue
+  adherence_stats                 GET /adherence/stats query path (daily rollup)
+  adherence_stats_aggregate       the dose_logs aggregate it falls back to
+
+The setup steps leave the rollup counters inflated; that changes no timings.
+
+    python -m benchmarks.micro --sizes 100:3:30,1000:3:30 --output micro.json
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from .common import DEFAULT_DATABASE_URL, configure, measure, reset_schema, write_results
+
+
+def _parse_sizes(spec: str) -> list[tuple[int, int, int]]:
+    sizes = []
+    for part in spec.split(','):
+        users, meds, days = (int(x) for x in part.split(':'))
+        sizes.append((users, meds, days))
+    return sizes
+
+
+def run_size(users: int, meds: int, days: int, repeat: int, seed_value: int) -> dict:
+    from sqlalchemy import delete, update
+    from app import models
+    from app.database import SessionLocal
+    from app.routers.adherence import _counts
+    from app.services import adherence_rollup
+    from app.services.scheduler import check_missed_doses, generate_schedules
+    from .seed import seed
+
+    reset_schema()
+    db = SessionLocal()
+    try:
+        counts = seed(db, users, meds, days, seed_value)
+        results = {'rows': counts}
+
+        rng = random.Random(seed_value)
+        sample = [rng.randint(1, users) for _ in range(max(repeat, 20))]
+        since = datetime.utcnow() - timedelta(days=30)
+        until = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.min.time())
+        calls = iter(sample)
+        results['adherence_stats'], _ = measure(lambda: _counts(db, next(calls), since), len(sample))
+        calls = iter(sample)
+        results['adherence_stats_aggregate'], _ = measure(
+            lambda: adherence_rollup.aggregate(db, next(calls), since, until), len(sample),
+        )
+
+        today = datetime.utcnow().date()
+        day_start = datetime(today.year, today.month, today.day)
+
+        def reset_horizon():
+            db.execute(delete(models.DoseLog).where(models.DoseLog.scheduled_at >= day_start))
+            db.execute(delete(models.DoseDailyRollup).where(models.DoseDailyRollup.day >= today))
+            db.execute(update(models.Medication).values(scheduled_through=None))
+            db.commit()
+
+        stats, inserted = measure(lambda: generate_schedules(db), repeat, reset_horizon)
+        results['generate_schedules'] = {**stats, 'rows': inserted}
+        stats, inserted = measure(lambda: generate_schedules(db), repeat)
+        results['generate_schedules_noop'] = {**stats, 'rows': inserted}
+
+        def reopen_yesterday():
+            db.execute(
+                update(models.DoseLog)
+                .where(models.DoseLog.scheduled_at >= day_start - timedelta(days=1),
+                       models.DoseLog.scheduled_at < day_start)
+                .values(status='scheduled', taken_at=None)
+            )
+            db.commit()
+
+        stats, missed = measure(lambda: check_missed_doses(db), repeat, reopen_yesterday)
+        results['check_missed_doses'] = {**stats, 'rows': len(missed)}
+        # Sweep whatever the reopened runs left overdue first
+        check_missed_doses(db)
+        stats, missed = measure(lambda: check_missed_doses(db), repeat)
+        results['check_missed_doses_noop'] = {**stats, 'rows': len(missed)}
+        return results
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--sizes', default='100:3:30,1000:3:30', help='comma-separated users:meds:days')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help="JSON results path, '-' for stdout")
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    results = []
+    for users, meds, days in _parse_sizes(args.sizes):
+        results.append({'users': users, 'meds_per_user': meds, 'days': days,
+                        **run_size(users, meds, days, args.repeat, args.seed)})
+    params = {k: v for k, v in vars(args).items() if k != 'database_url'}
+    write_results(args.output, 'micro', params, results)
+
+
+if __name__ == '__main__':
+    main()
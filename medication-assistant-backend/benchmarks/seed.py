@@ -0,0 +1,128 @@
+"""
+Seeded synthetic data: N users with M medications each and K days of dose history.
+
+The same --seed always produces the same rows, so runs on different commits or
+databases are comparable. Rows are inserted in executemany batches and the daily
+rollup is rebuilt at the end, exactly as a production database would have it.
+
+    python -m benchmarks.seed --database-url postgresql://localhost/medbench --users 1000 --meds 3 --days 90
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from .common import DEFAULT_DATABASE_URL, configure, reset_schema
+
+# Every seeded user logs in with this password (the load driver relies on it)
+PASSWORD = 'benchmark-password'
+DOSE_TIMES = ('07:00', '08:00', '09:30', '12:00', '13:30', '18:00', '20:00', '22:00')
+STATUSES = ('taken', 'missed', 'skipped')
+STATUS_WEIGHTS = (80, 15, 5)
+BATCH_SIZE = 5000
+
+
+def email_for(user_id: int) -> str:
+    return f'user{user_id}@example.com'
+
+
+def _days_of_week(rng: random.Random) -> str:
+    if rng.random() < 0.7:
+        return 'all'
+    return ','.join(str(d) for d in sorted(rng.sample(range(7), rng.randint(1, 6))))
+
+
+def _insert(db, table, rows: list) -> None:
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.execute(table.insert(), rows[i:i + BATCH_SIZE])
+
+
+def seed(db, users: int, meds_per_user: int, days: int, seed: int = 0) -> dict:
+    """Insert the synthetic data set into an empty schema; returns row counts."""
+    from sqlalchemy import text
+    from app import models
+    from app.auth import get_password_hash
+    from app.services import adherence_rollup, schedule
+
+    rng = random.Random(seed)
+    password_hash = get_password_hash(PASSWORD)
+    _insert(db, models.User.__table__, [
+        {'id': u, 'email': email_for(u), 'hashed_password': password_hash, 'full_name': f'User {u}', 'is_active': True}
+        for u in range(1, users + 1)
+    ])
+
+    meds, times, slots = [], [], []
+    for u in range(1, users + 1):
+        for _ in range(meds_per_user):
+            med_id = len(meds) + 1
+            times_of_day = sorted(rng.sample(DOSE_TIMES, rng.randint(1, 3)))
+            days_of_week = _days_of_week(rng)
+            mask = schedule.weekday_mask(days_of_week)
+            minutes = schedule.minutes_of_day(times_of_day)
+            meds.append({
+                'id': med_id, 'user_id': u, 'name': f'Medication {med_id}', 'dosage': f'{rng.choice((1, 2))} pill',
+                'notes': None, 'start_date': None, 'end_date': None,
+                'times_of_day': json.dumps(times_of_day), 'days_of_week': days_of_week, 'weekday_mask': mask,
+            })
+            times.extend({'medication_id': med_id, 'minute_of_day': m} for m in minutes)
+            slots.append((med_id, mask, minutes))
+    _insert(db, models.Medication.__table__, meds)
+    _insert(db, models.MedicationTime.__table__, times)
+
+    # History up to yesterday (UTC days, like the scheduler); upcoming slots are left to it
+    today = datetime.utcnow().date()
+    doses, dose_count = [], 0
+    for back in range(days, 0, -1):
+        day = today - timedelta(days=back)
+        day_start = datetime(day.year, day.month, day.day)
+        bit = 1 << day.weekday()
+        for med_id, mask, minutes in slots:
+            if not mask & bit:
+                continue
+            for minute in minutes:
+                scheduled_at = day_start + timedelta(minutes=minute)
+                status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+                taken_at = scheduled_at + timedelta(minutes=rng.randint(-15, 90)) if status == 'taken' else None
+                doses.append({'medication_id': med_id, 'scheduled_at': scheduled_at, 'status': status,
+                              'taken_at': taken_at, 'notes': None})
+                if len(doses) == BATCH_SIZE:
+                    _insert(db, models.DoseLog.__table__, doses)
+                    dose_count += len(doses)
+                    doses = []
+    _insert(db, models.DoseLog.__table__, doses)
+    dose_count += len(doses)
+
+    if db.get_bind().dialect.name == 'postgresql':
+        # Explicit ids bypass the serial sequences; move them past the seeded rows
+        for table in ('users', 'medications'):
+            db.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+    db.commit()
+    adherence_rollup.backfill(db)
+    return {'users': users, 'medications': len(meds), 'medication_times': len(times), 'dose_logs': dose_count}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--meds', type=int, default=3, help='medications per user')
+    parser.add_argument('--days', type=int, default=30, help='days of dose history')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    from app.database import SessionLocal
+
+    reset_schema()
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        counts = seed(db, args.users, args.meds, args.days, args.seed)
+    finally:
+        db.close()
+    print(f'seeded {counts} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Sharded scheduler tick across worker processes: checks that concurrent workers
+never create duplicate doses and measures the speedup as workers are added.
+
+For each worker count the materialised horizon (doses from today on) and the tick
+leases are cleared, then that many processes run scheduler.run_tick() together
+(`--ticks` times each) under SCHEDULER_MODE=sharded, or =leader with `--mode leader`,
+where every tick's passes should come from a single worker.
+The wall time is from the common start signal until the last process exits.
+
+Expect near-linear speedup on Postgres only. SQLite allows one writer at a time,
+so concurrent shard passes queue on the database lock and pay for the lock
+retries on top: there, more workers are slower (about 0.2-0.5x at 2 workers).
+duplicate_slots must be 0 on both.
+
+    python -m benchmarks.shards --database-url postgresql://localhost/medbench --users 5000 --workers 1,2,4,8
+    python -m benchmarks.shards --mode leader --ticks 3 --workers 4
+"""
+import argparse
+import multiprocessing
+import time
+from datetime import datetime
+
+from .common import DEFAULT_DATABASE_URL, configure, reset_schema, write_results
+
+
+def _worker(start, results, ticks) -> None:
+    from app.database import SessionLocal
+    from app.services.scheduler import run_tick
+
+    db = SessionLocal()
+    try:
+        db.connection()  # connect before the start signal
+        start.wait()
+        results.put([run_tick(db) for _ in range(ticks)])
+    finally:
+        db.close()
+
+
+def _day_start() -> datetime:
+    today = datetime.utcnow().date()
+    return datetime(today.year, today.month, today.day)
+
+
+def _reset_horizon(db) -> None:
+    from sqlalchemy import delete, update
+    from app import models
+
+    db.execute(delete(models.DoseLog).where(models.DoseLog.scheduled_at >= _day_start()))
+    db.execute(delete(models.DoseDailyRollup).where(models.DoseDailyRollup.day >= _day_start().date()))
+    db.execute(update(models.Medication).values(scheduled_through=None))
+    db.execute(delete(models.SchedulerLease))
+    db.commit()
+
+
+def _horizon_counts(db) -> dict:
+    from sqlalchemy import func, select
+    from app import models
+
+    doses = select(models.DoseLog.medication_id, models.DoseLog.scheduled_at).where(
+        models.DoseLog.scheduled_at >= _day_start(),
+    )
+    total = db.execute(select(func.count()).select_from(doses.subquery())).scalar_one()
+    dupes = db.execute(
+        select(func.count()).select_from(
+            doses.group_by(models.DoseLog.medication_id, models.DoseLog.scheduled_at)
+            .having(func.count() > 1).subquery()
+        )
+    ).scalar_one()
+    return {'doses': total, 'duplicate_slots': dupes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--meds', type=int, default=3)
+    parser.add_argument('--mode', choices=('sharded', 'leader'), default='sharded')
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--ticks', type=int, default=1, help='back-to-back ticks per worker')
+    parser.add_argument('--workers', default='1,2,4,8', help='comma-separated worker counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-', help="JSON results path, '-' for stdout")
+    args = parser.parse_args()
+
+    # Children are spawned, so they import app afresh with this environment
+    configure(args.database_url, SCHEDULER_MODE=args.mode, SCHEDULER_SHARDS=str(args.shards))
+    from app.database import SessionLocal
+    from .seed import seed
+
+    reset_schema()
+    db = SessionLocal()
+    seed(db, args.users, args.meds, 0, args.seed)
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for workers in (int(w) for w in args.workers.split(',')):
+        _reset_horizon(db)
+        start, passes = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(start, passes, args.ticks)) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        time.sleep(1)  # let the children import the app and connect
+        began = time.perf_counter()
+        start.set()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - began
+        shard_passes = [passes.get() for p in procs if p.exitcode == 0]
+        results.append({
+            'workers': workers,
+            'seconds': round(elapsed, 3),
+            'shard_passes': shard_passes,
+            # Workers that ran any pass; 1 in leader mode
+            'leaders': sum(1 for ticks in shard_passes if any(ticks)),
+            'failed_workers': sum(1 for p in procs if p.exitcode != 0),
+            **_horizon_counts(db),
+        })
+    db.close()
+
+    baseline = results[0]['seconds']
+    for r in results:
+        r['speedup'] = round(baseline / r['seconds'], 2) if r['seconds'] else None
+    params = {k: v for k, v in vars(args).items() if k != 'database_url'}
+    write_results(args.output, 'shards', params, results)
+
+
+if __name__ == '__main__':
+    main()
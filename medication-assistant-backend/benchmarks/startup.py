@@ -0,0 +1,98 @@
+"""
+Cold-start cost of a worker: `import app.main` in a fresh interpreter, and the
+time from launching uvicorn until it serves its first /health request (what a
+new worker or autoscaled pod pays before taking traffic).
+
+Also records which heavy optional modules were imported eagerly; the app should
+load them on first use, so this list is expected to stay empty.
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .common import DEFAULT_DATABASE_URL, configure, summarize, write_results
+
+# Modules the app must not import until they are needed
+LAZY_MODULES = ('openai', 'httpx', 'apscheduler', 'passlib', 'uvicorn', 'redis', 'numpy')
+
+_IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "eager": sorted(m for m in %r if m in sys.modules)}))
+''' % (LAZY_MODULES,)
+
+
+def measure_import(repeat: int) -> dict:
+    samples, eager = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _IMPORT_PROBE], check=True, capture_output=True, text=True)
+        probe = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(probe['seconds'])
+        eager = probe['eager']
+    return {**summarize(samples), 'eager_modules': eager}
+
+
+def measure_interpreter(repeat: int) -> dict:
+    """Bare interpreter start: the floor under both figures below."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def measure_first_request(repeat: int, port: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                                 '--log-level', 'warning'])
+        try:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f'uvicorn exited with {proc.returncode} during startup')
+                try:
+                    if httpx.get(f'http://127.0.0.1:{port}/health', timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+            samples.append(time.perf_counter() - start)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    return summarize(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--output', default='-', help="JSON results path, '-' for stdout")
+    args = parser.parse_args()
+
+    configure(args.database_url)
+    # The schema is created once up front, as a deploy would, not by the workers being timed
+    subprocess.run([sys.executable, '-m', 'app.migrations'], check=True, env=os.environ)
+
+    results = {
+        'interpreter': measure_interpreter(args.repeat),
+        'import_app_main': measure_import(args.repeat),
+        'first_request': measure_first_request(args.repeat, args.port),
+    }
+    params = {k: v for k, v in vars(args).items() if k != 'database_url'}
+    write_results(args.output, 'startup', params, results)
+
+
+if __name__ == '__main__':
+    main()
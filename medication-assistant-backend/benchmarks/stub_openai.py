@@ -0,0 +1,129 @@
+"""
+Stand-in for the Azure OpenAI chat completions endpoint, so load runs exercise the
+real client, connection pool and cache without a deployment or token spend.
+
+Replies after STUB_OPENAI_LATENCY_MS (default 300) and streams in three chunks.
+Point the app at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:<port>.
+
+Faults for exercising the gateway (services.llm_gateway) are injected at random
+per call: a fraction answered 429 with Retry-After, a fraction answered 500 and
+a fraction left hanging past the client timeout. Set them with the flags below
+or at runtime with `PUT /faults {"rate_limit": 0.5}`.
+
+    python -m benchmarks.stub_openai --port 9100
+    python -m benchmarks.stub_openai --rate-limit 0.2 --retry-after 1 --timeout-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title='Stub Azure OpenAI')
+LATENCY = float(os.environ.get('STUB_OPENAI_LATENCY_MS', '300')) / 1000
+calls = {'completions': 0, 'rate_limited': 0, 'server_errors': 0, 'hung': 0}
+faults = {'rate_limit': 0.0, 'retry_after': 1.0, 'server_error': 0.0, 'timeout': 0.0, 'hang_seconds': 120.0}
+_rng = random.Random(0)
+
+
+def _error(status: int, message: str, headers=None) -> JSONResponse:
+    return JSONResponse({'error': {'code': str(status), 'message': message}}, status_code=status, headers=headers)
+
+
+async def _inject_fault():
+    """Error response for this call, if one is drawn; a drawn timeout just hangs."""
+    draw = _rng.random()
+    if draw < faults['rate_limit']:
+        calls['rate_limited'] += 1
+        return _error(429, 'Rate limit is exceeded.', {'Retry-After': f"{faults['retry_after']:g}"})
+    draw -= faults['rate_limit']
+    if draw < faults['server_error']:
+        calls['server_errors'] += 1
+        return _error(500, 'Internal server error.')
+    draw -= faults['server_error']
+    if draw < faults['timeout']:
+        calls['hung'] += 1
+        await asyncio.sleep(faults['hang_seconds'])
+    return None
+
+
+def _chunk(delta: dict, finish_reason=None) -> str:
+    return 'data: ' + json.dumps({
+        'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+    }) + '\n\n'
+
+
+def _usage(messages: list[dict], reply: str) -> dict:
+    prompt_tokens = sum(len(m['content'].split()) for m in messages)
+    completion_tokens = len(reply.split())
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens}
+
+
+@app.post('/openai/deployments/{deployment}/chat/completions')
+async def completions(deployment: str, request: Request):
+    body = await request.json()
+    calls['completions'] += 1
+    fault = await _inject_fault()
+    if fault is not None:
+        return fault
+    prompt = body['messages'][-1]['content']
+    reply = f'Stub reply to: {prompt[:80]}'
+    if body.get('stream'):
+        async def stream():
+            words = reply.split(' ')
+            third = max(1, len(words) // 3)
+            for i in range(0, len(words), third):
+                await asyncio.sleep(LATENCY / 3)
+                yield _chunk({'content': ' '.join(words[i:i + third]) + ' '})
+            yield _chunk({}, 'stop')
+            if (body.get('stream_options') or {}).get('include_usage'):
+                yield 'data: ' + json.dumps({
+                    'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                    'choices': [], 'usage': _usage(body['messages'], reply),
+                }) + '\n\n'
+            yield 'data: [DONE]\n\n'
+        return StreamingResponse(stream(), media_type='text/event-stream')
+
+    await asyncio.sleep(LATENCY)
+    return {
+        'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+        'usage': _usage(body['messages'], reply),
+    }
+
+
+@app.get('/stats')
+async def stats():
+    return {**calls, 'faults': faults}
+
+
+@app.put('/faults')
+async def set_faults(request: Request):
+    changes = await request.json()
+    faults.update({k: float(v) for k, v in changes.items() if k in faults})
+    return faults
+
+
+def main() -> None:
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='fraction of calls answered 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds on 429s')
+    parser.add_argument('--server-error', type=float, default=0.0, help='fraction of calls answered 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction of calls left hanging')
+    parser.add_argument('--hang-seconds', type=float, default=120.0)
+    args = parser.parse_args()
+    faults.update(rate_limit=args.rate_limit, retry_after=args.retry_after, server_error=args.server_error,
+                  timeout=args.timeout_rate, hang_seconds=args.hang_seconds)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+
+import pytest
+
+from app import models, schemas
+from app.database import SessionLocal
+from app.migrations import create_schema
+from app.routers.medications import _apply_dose_batch
+
+
+@pytest.fixture
+def db():
+    create_schema()
+    session = SessionLocal()
+    user = models.User(email=f'batch-{datetime.utcnow().timestamp()}@example.com', hashed_password='x', is_active=True)
+    session.add(user)
+    session.flush()
+    med = models.Medication(user_id=user.id, name='A', dosage='1 pill', times_of_day='[]', days_of_week='all')
+    session.add(med)
+    session.flush()
+    start = datetime.utcnow() - timedelta(hours=3)
+    session.add_all(
+        models.DoseLog(medication_id=med.id, scheduled_at=start + timedelta(minutes=i), status='scheduled')
+        for i in range(3)
+    )
+    session.commit()
+    session.user_id = user.id
+    session.dose_ids = [d.id for d in session.query(models.DoseLog).filter_by(medication_id=med.id).order_by(models.DoseLog.id)]
+    yield session
+    session.close()
+
+
+def _doses(db, ids):
+    db.expire_all()
+    rows = db.query(models.DoseLog).filter(models.DoseLog.id.in_(ids)).order_by(models.DoseLog.id).all()
+    return [(d.status, d.taken_at is not None) for d in rows]
+
+
+def test_batch_mixes_taken_and_skipped(db):
+    taken, skipped, _ = db.dose_ids
+    result = _apply_dose_batch(db, db.user_id, [
+        schemas.DoseStatusUpdate(dose_id=taken, status='taken'),
+        schemas.DoseStatusUpdate(dose_id=skipped, status='skipped'),
+    ])
+    assert [r.ok for r in result.results] == [True, True]
+    assert _doses(db, [taken, skipped]) == [('taken', True), ('skipped', False)]
+
+
+def test_batch_all_skipped(db):
+    # Every taken_at branch is NULL; the UPDATE must still type as a timestamp
+    result = _apply_dose_batch(db, db.user_id, [
+        schemas.DoseStatusUpdate(dose_id=dose_id, status='skipped') for dose_id in db.dose_ids
+    ])
+    assert all(r.ok for r in result.results)
+    assert _doses(db, db.dose_ids) == [('skipped', False)] * 3
+
+
+def test_batch_reports_unknown_doses(db):
+    result = _apply_dose_batch(db, db.user_id, [schemas.DoseStatusUpdate(dose_id=10 ** 9, status='skipped')])
+    assert [(r.ok, r.error) for r in result.results] == [(False, 'Dose not found')]